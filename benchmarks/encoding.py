@@ -0,0 +1,97 @@
+"""
+Benchmarks for serializing and compressing events.
+
+Run with ``python -m benchmarks.encoding -o encoding.json`` from the
+root of the repository.
+
+"""
+import logging
+import zlib
+
+import raven
+
+from benchmarks import capture, common
+from sprockets.mixins import sentry
+from sprockets.mixins.sentry import serializer
+
+
+def make_event(client, size):
+    """Build an event the same way a failing request does."""
+    handler = common.make_handler(
+        capture.FailingHandler, capture.make_application(),
+        method='POST', uri='/fail?page=1',
+        body=b'{"name": "' + b'x' * size + b'"}',
+        headers={'Content-Type': 'application/json',
+                 'User-Agent': 'benchmark'})
+    handler.sentry_extra.update(capture.make_payload(size)['extra'])
+    try:
+        raise RuntimeError('benchmark')
+    except RuntimeError:
+        return client.build_msg('raven.events.Exception',
+                                **handler._build_sentry_kwargs())
+
+
+def encode():
+    """Cost and size of encoding events by serializer and compression."""
+    client = sentry.get_client(capture.make_application())
+    serializers = ['json']
+    if serializer.orjson is not None:
+        serializers.append('orjson')
+    results = {}
+    for size in (10, 100, 1000):
+        event = make_event(client, size)
+        number = max(20, 20000 // size)
+        result = common.measure(lambda: raven.Client.encode(client, event),
+                                number=number)
+        result['bytes'] = len(raven.Client.encode(client, event))
+        results['raven/{0}'.format(size)] = result
+        for name in serializers:
+            for level in (0, 1, 6):
+                encoder = serializer.Encoder(name, compress_level=level)
+                result = common.measure(lambda: encoder.encode(event),
+                                        number=number)
+                result['bytes'] = len(encoder.encode(event))
+                results['{0}/level{1}/{2}'.format(name, level, size)] = result
+            encoder = serializer.Encoder(name, compress_threshold=1 << 20)
+            result = common.measure(lambda: encoder.encode(event),
+                                    number=number)
+            result['bytes'] = len(encoder.encode(event))
+            results['{0}/uncompressed/{1}'.format(name, size)] = result
+        client.event_encoder.compress_threshold = 1 << 30  # isolate
+        for preserialize in (False, True):
+            client.preserialize = preserialize
+            result = common.measure(lambda: client.encode(event),
+                                    number=number)
+            result['bytes'] = len(client.encode(event))
+            result['memory'] = common.allocations(
+                lambda: client.encode(event), number=number)
+            results['client/{0}/{1}'.format(
+                'preserialized' if preserialize else 'plain', size)] = result
+        client.event_encoder.compress_threshold = 0
+    return results
+
+
+def compress():
+    """Cost of compression alone by level for a serialized event."""
+    client = sentry.get_client(capture.make_application())
+    body = serializer.JSONSerializer().dumps(
+        serializer.normalize(make_event(client, 100)))
+    results = {}
+    for level in (1, 6, 9):
+        result = common.measure(lambda: zlib.compress(body, level),
+                                number=500)
+        result['bytes'] = len(zlib.compress(body, level))
+        result['ratio'] = round(len(body) / result['bytes'], 2)
+        results['level{0}'.format(level)] = result
+    return results
+
+
+BENCHMARKS = {
+    'encode': encode,
+    'compress': compress,
+}
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    common.main(BENCHMARKS, __doc__.strip().splitlines()[0])
@@ -0,0 +1,133 @@
+"""
+Benchmarks for the memory held by events that wait to be reported.
+
+Run with ``python -m benchmarks.memory -o memory.json`` from the root of
+the repository.
+
+"""
+import logging
+import multiprocessing
+import os
+import resource
+import time
+
+from tornado import gen, httpclient, httpserver, ioloop, testing, web
+
+from benchmarks import common
+from sprockets.mixins import sentry
+
+BUFFER_SIZE = 256 * 1024
+
+
+class BufferHandler(sentry.SentryMixin, web.RequestHandler):
+    """Fails while a large buffer and request are referenced."""
+
+    async def get(self):
+        buffer = bytearray(BUFFER_SIZE)
+        self.sentry_extra['document'] = {'rows': list(range(1000))}
+        await gen.sleep(0)
+        raise RuntimeError('storm with {0} bytes'.format(len(buffer)))
+
+
+def rss():
+    """Current resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):  # pragma: no cover -- not Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_storm(settings, requests, concurrency, delay):
+    """Run one storm and sample RSS; runs in a fresh process."""
+    logging.disable(logging.CRITICAL)
+
+    async def storm():
+        fake_sentry = common.FakeSentry(delay=delay)
+        fake_sentry.start()
+        application = web.Application([(r'/fail', BufferHandler)])
+        if settings is None:
+            application.sentry_client = None
+        else:
+            sentry.install(application, dsn=fake_sentry.dsn,
+                           tornado_transport={'max_queue_size': requests},
+                           worker_pool={'max_pending': requests},
+                           **settings)
+        client = sentry.get_client(application)
+        pool = getattr(client, 'worker_pool', None)
+        sock, port = testing.bind_unused_port()
+        server = httpserver.HTTPServer(application)
+        server.add_sockets([sock])
+        http_client = httpclient.AsyncHTTPClient(force_instance=True,
+                                                 max_clients=concurrency)
+        url = 'http://127.0.0.1:{0}/fail'.format(port)
+        await http_client.fetch(url, raise_error=False)  # warm up
+        if client is not None:
+            await client.flush()
+
+        samples, pending = [rss()], [0]
+
+        def sample():
+            samples.append(rss())
+            pending.append(pool.pending if pool is not None else 0)
+
+        sampler = ioloop.PeriodicCallback(sample, 10)
+        sampler.start()
+        start = time.perf_counter()
+        await gen.multi([http_client.fetch(url, raise_error=False)
+                         for _ in range(requests)])
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        sample()
+
+        http_client.close()
+        server.stop()
+        fake_sentry.stop()
+        if pool is not None:
+            pool.shutdown(wait=False)
+        baseline = samples[0]
+        step = max(1, len(samples) // 10)
+        return {'requests': requests,
+                'elapsed_sec': round(elapsed, 4),
+                'baseline_rss_mb': round(baseline / 1048576, 2),
+                'peak_growth_mb': round((max(samples) - baseline) /
+                                        1048576, 2),
+                'final_growth_mb': round((samples[-1] - baseline) /
+                                         1048576, 2),
+                'growth_timeline_mb': [round((value - baseline) / 1048576, 2)
+                                       for value in samples[::step]],
+                'peak_pending': max(pending)}
+
+    return ioloop.IOLoop.current().run_sync(storm)
+
+
+def storm(requests=2000, concurrency=50, delay=0.05):
+    """
+    RSS growth during an exception storm against a slow Sentry stand-in.
+
+    Every request fails while it refers to a large buffer.  Events are
+    built by a single worker and delivered to a stand-in that waits
+    `delay` seconds per event, so events queue up.  Each variant runs in
+    a fresh process so that their memory does not mix.  ``unreported``
+    does not install a client and shows the growth of the storm itself.
+
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name, settings in (('unreported', None),
+                           ('snapshots', {}),
+                           ('tracebacks', {'snapshots': False})):
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(
+                run_storm, (settings, requests, concurrency, delay))
+    return results
+
+
+BENCHMARKS = {
+    'storm': storm,
+}
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    common.main(BENCHMARKS, __doc__.strip().splitlines()[0])
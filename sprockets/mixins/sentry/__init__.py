@@ -4,18 +4,43 @@ mixins.sentry
 A RequestHandler mixin for sending exceptions to Sentry
 
 """
+import collections
+import contextlib
+import functools
+import importlib
 import logging
 import math
 import os
 import re
 import time
+import weakref
 
-import raven
-from raven.processors import SanitizePasswordsProcessor
-from tornado import web
+from tornado import ioloop, web
+
+from sprockets.mixins.sentry import (breadcrumbs, environ, metrics, payload,
+                                     ratelimit, slow, snapshot)
 
 LOGGER = logging.getLogger(__name__)
 SENTRY_CLIENT = 'sentry_client'
+SENTRY_CLIENT_FACTORY = 'sentry_client_factory'
+
+# raven takes longer to import than tornado.web, so the names that need
+# it are imported by the first lookup instead of with this package.
+_LAZY_ATTRIBUTES = {
+    'Client': 'client',
+    'DROP_NEWEST': 'transport',
+    'DROP_OLDEST': 'transport',
+    'TornadoTransport': 'transport',
+    'SanitizeEmailsProcessor': 'processors',
+    'SanitizePasswordsAndEmailsProcessor': 'processors',
+    'SanitizePasswordsProcessor': 'processors',
+}
+_SUBMODULES = frozenset([
+    'background', 'breadcrumbs', 'circuit', 'client', 'environ',
+    'forwarder', 'frames', 'httperrors', 'metrics', 'payload',
+    'processors', 'profiler', 'ratelimit', 'sampling', 'serializer',
+    'skeleton', 'slow', 'snapshot', 'spool', 'transport', 'watchdog',
+    'workers'])
 
 # This matches the userinfo production from RFC3986 with some extra
 # leniancy to account for poorly formed URLs.  For example, it lets
@@ -26,51 +51,22 @@ URI_RE = re.compile(r"^[\w\+\-]+://"
                     r"@",
                     re.IGNORECASE)
 
-_sentry_warning_issued = False
-
-
-class SanitizeEmailsProcessor(SanitizePasswordsProcessor):
-    """
-    Remove all email addresses from the payload sent to sentry.
-
-    """
 
-    FIELDS = frozenset(['email', 'email_address'])
-    VALUES_RE = re.compile(r"""
-    ((?:[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|"
-      (?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|
-       \\[\x01-\x09\x0b\x0c\x0e-\x7f])*\")
-      @
-      (?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9]
-      (?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:25[0-5]|2[0-4][0-9]|
-       [01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?|
-       [a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|
-       \\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\]))
-    """, re.VERBOSE ^ re.IGNORECASE)  # RFC5322
-
-    def sanitize(self, key, value):
-        if value is None:
-            return
-
-        if isinstance(value, str):
-            return self.VALUES_RE.sub(self.MASK, value)
-
-        if not key:  # key can be a NoneType
-            return value
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(
+            '{0}.{1}'.format(__name__, _LAZY_ATTRIBUTES[name]))
+        value = globals()[name] = getattr(module, name)
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module('{0}.{1}'.format(__name__, name))
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(
+        __name__, name))
 
-        # Just in case we have bytes here, we want to make them into text
-        # properly without failing so we can perform our check.
-        if isinstance(key, bytes):
-            key = key.decode('utf-8', 'replace')
-        else:
-            key = str(key)
 
-        key = key.lower()
-        for field in self.FIELDS:
-            if field in key:
-                # store mask as a fixed length for security
-                return self.MASK
-        return value
+_sentry_warning_issued = False
+_environ_snapshot = environ.EnvironmentSnapshot()
+_UNRESOLVED = object()
 
 
 class SentryMixin:
@@ -88,6 +84,10 @@ class SentryMixin:
     If an exception is caught by :meth:`._handle_request_exception`, then
     it will be reported to Sentry in all it's glory.
 
+    When the client records breadcrumbs or reports slow requests,
+    recording starts in :meth:`prepare`, so handlers that override it
+    must call the ``super`` implementation.
+
     .. attribute:: sentry_client
 
        The :class:`raven.base.Client` instance or :data:`None` if sentry
@@ -95,70 +95,347 @@ class SentryMixin:
        as required for your application -- for example, you can add new
        modules by adding to ``self.sentry_client.include_paths``.
 
+       The client is looked up the first time that it is used, so
+       requests that do not raise never look it up, and :func:`install`
+       is attempted once per application and handler class.
+
     .. attribute:: sentry_extra
 
        A :class:`dict` of extra information to pass to sentry when an
-       exception is reported.
+       exception is reported.  It is created on first access.
 
     .. attribute:: sentry_tags
 
        A :class:`dict` of tag and value pairs to associated with any
-       reported exceptions.
+       reported exceptions.  It is created on first access.
 
-    """
+    .. attribute:: sentry_sample_rate
 
-    def __init__(self, *args, **kwargs):
-        self.sentry_client = None
-        self.sentry_extra = {}
-        self.sentry_tags = {}
-        super().__init__(*args, **kwargs)
+       Set this class attribute to override the sample rate for the
+       handler when the client has a
+       :class:`~sprockets.mixins.sentry.sampling.SamplingPolicy`.
 
-    def initialize(self):
-        self.sentry_client = get_client(self.application)
-        if self.sentry_client is None:
-            install(self.application)
-            self.sentry_client = get_client(self.application)
-        super().initialize()
+    .. attribute:: sentry_slow_threshold
+
+       Set this class attribute to override the number of seconds after
+       which a request to the handler is reported as slow when the client
+       has a :class:`~sprockets.mixins.sentry.slow.SlowRequestPolicy`.
+
+    """
+
+    sentry_sample_rate = None
+    sentry_slow_threshold = None
+
+    _sentry_client = _UNRESOLVED
+    _sentry_installed_for = None  # weakref to the last application
+    _sentry_extra = None
+    _sentry_tags = None
+    _sentry_failed = False
+    _sentry_prepared = None
+    _sentry_finished = None
+    _sentry_spans = None
+    _sentry_profile = None
+
+    @property
+    def sentry_client(self):
+        client = self._sentry_client
+        if client is not _UNRESOLVED:
+            return client
+        application = getattr(self, 'application', None)
+        if application is None:
+            return None
+        # the client itself is not cached so that replacing
+        # application.sentry_client takes effect immediately
+        ref = self._sentry_installed_for
+        if ref is None or ref() is not application:
+            if get_client(application) is None:
+                install(application)
+            self.__class__._sentry_installed_for = weakref.ref(application)
+        return get_client(application)
+
+    @sentry_client.setter
+    def sentry_client(self, client):
+        self._sentry_client = client
+
+    @property
+    def sentry_extra(self):
+        if self._sentry_extra is None:
+            self._sentry_extra = {}
+        return self._sentry_extra
+
+    @sentry_extra.setter
+    def sentry_extra(self, extra):
+        self._sentry_extra = extra
+
+    @property
+    def sentry_tags(self):
+        if self._sentry_tags is None:
+            self._sentry_tags = {}
+        return self._sentry_tags
+
+    @sentry_tags.setter
+    def sentry_tags(self, tags):
+        self._sentry_tags = tags
+
+    @contextlib.contextmanager
+    def sentry_span(self, name):
+        """
+        Time a section of the request for slow request reports.
+
+        :param str name: identifies the section in the report
+
+        .. code-block:: python
+
+           with self.sentry_span('database'):
+               rows = await self.query()
+
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._add_sentry_span(name, start, time.time())
+
+    def prepare(self):
+        client = self.sentry_client
+        size = getattr(client, 'breadcrumb_size', None)
+        if size:
+            breadcrumbs.activate(size)
+        if getattr(client, 'slow_request_policy', None) is not None:
+            self._sentry_prepared = time.time()
+        profiler = getattr(client, 'profiler', None)
+        if profiler is not None:
+            profiler.start(self)
+        return super().prepare()
+
+    def flush(self, *args, **kwargs):
+        if self._sentry_prepared is None:
+            return super().flush(*args, **kwargs)
+        start = time.time()
+        try:
+            return super().flush(*args, **kwargs)
+        finally:
+            self._add_sentry_span('flush', start, time.time())
+
+    def finish(self, *args, **kwargs):
+        if self._sentry_prepared is not None and \
+                self._sentry_finished is None:
+            self._sentry_finished = time.time()
+        return super().finish(*args, **kwargs)
+
+    def on_finish(self):
+        aggregator = getattr(self.sentry_client, 'http_error_aggregator',
+                             None)
+        if aggregator is not None:
+            aggregator.record(self.__class__.__name__, self.get_status())
+        # failed requests are reported as exceptions, or deliberately
+        # not reported, so they are never reported as slow
+        if self._sentry_prepared is not None and not self._sentry_failed:
+            self._report_slow_request()
+        if self._sentry_profile is not None:
+            self.sentry_client.profiler.stop(self._sentry_profile)
+        super().on_finish()
+
+    def _add_sentry_span(self, name, start, end):
+        if self._sentry_spans is None:
+            self._sentry_spans = []
+        self._sentry_spans.append((name, start, end))
+
+    def _report_slow_request(self):
+        client = self.sentry_client
+        policy = client.slow_request_policy
+        now = time.time()
+        elapsed = now - self.request._start_time
+        threshold = policy.get_threshold(self.request.path,
+                                         self.sentry_slow_threshold)
+        if threshold is None or elapsed < threshold:
+            return
+        if not policy.should_report(self.__class__.__name__):
+            return
+        slow_request = {
+            'duration_ms': round(elapsed * 1000, 3),
+            'threshold_ms': round(threshold * 1000, 3),
+            'status_code': self.get_status(),
+            'spans': slow.breakdown(self.request._start_time,
+                                    self._sentry_prepared,
+                                    self._sentry_finished, now,
+                                    self._sentry_spans or ())}
+        message = 'Slow request to {0}'.format(self.__class__.__name__)
+        event_snapshot = self._take_sentry_snapshot()
+        pool = getattr(client, 'worker_pool', None)
+        if pool is not None:
+            limits = getattr(client, 'snapshot_limits', None)
+            if limits is not None:  # release the handler while queued
+                event_snapshot = _release_snapshot(event_snapshot, limits)
+            pool.submit_message(message, functools.partial(
+                _build_slow_request_kwargs, event_snapshot,
+                self.__class__.__name__, slow_request))
+        else:
+            client.captureMessage(message, **_build_slow_request_kwargs(
+                event_snapshot, self.__class__.__name__, slow_request))
 
     def _strip_uri_passwords(self, values):
         for key in values.keys():
+            if '://' not in values[key]:  # cannot match URI_RE
+                continue
             matches = URI_RE.search(values[key])
             if matches:
                 values[key] = values[key].replace(matches.group(1), '****')
         return values
 
+    def _build_sentry_kwargs(self):
+        return _build_event_kwargs(self._take_sentry_snapshot())
+
+    def _take_sentry_snapshot(self):
+        """Capture what an event needs from the handler without copying."""
+        extra = self.sentry_extra
+        extra.setdefault('handler', _handler_name(self.__class__))
+        if self._sentry_profile is not None:
+            extra['profile'] = self._sentry_profile.as_payload()
+        return _EventSnapshot(
+            self.sentry_client, extra, self._sentry_tags,
+            getattr(self, 'request', None), breadcrumbs.deactivate(),
+            math.ceil((time.time() - self.request._start_time) * 1000),
+            self._strip_uri_passwords)
+
     def _handle_request_exception(self, e):
         if (isinstance(e, web.HTTPError)
                 or isinstance(e, web.Finish)
                 or self.sentry_client is None):
             return super()._handle_request_exception(e)
 
-        duration = math.ceil((time.time() - self.request._start_time) * 1000)
-        kwargs = {'extra': self.sentry_extra, 'time_spent': duration}
-        kwargs['extra'].setdefault(
-            'handler', '{0}.{1}'.format(__name__, self.__class__.__name__))
-        kwargs['extra'].setdefault('env',
-                                   self._strip_uri_passwords(dict(os.environ)))
-        if hasattr(self, 'request'):
-            kwargs['data'] = {
-                'request': {
-                    'url': self.request.full_url(),
-                    'method': self.request.method,
-                    'data': self.request.body,
-                    'query_string': self.request.query,
-                    'cookies': self.request.headers.get('Cookie', {}),
-                    'headers': dict(self.request.headers)},
-                'logger': 'sprockets.mixins.sentry'}
-            kwargs['extra']['http_host'] = self.request.host
-            kwargs['extra']['remote_ip'] = self.request.remote_ip
-
-        if self.sentry_tags:
-            kwargs.update({'tags': self.sentry_tags})
-        self.sentry_client.captureException(**kwargs)
+        self._sentry_failed = True
+        recorder = getattr(self.sentry_client, 'metrics', None)
+        if recorder is not None:
+            started = time.perf_counter()
+
+        breaker = getattr(self.sentry_client, 'circuit_breaker', None)
+        if breaker is not None and not breaker.allow(probe=False):
+            if recorder is not None:
+                recorder.increment(metrics.SHORT_CIRCUITED)
+            return super()._handle_request_exception(e)
+
+        policy = getattr(self.sentry_client, 'sampling_policy', None)
+        if policy is not None and not policy.should_sample(
+                self.__class__.__name__, self.request.path, e.__class__,
+                self.sentry_sample_rate):
+            if recorder is not None:
+                recorder.increment(metrics.SAMPLED_OUT)
+            return super()._handle_request_exception(e)
+
+        limiter = getattr(self.sentry_client, 'rate_limiter', None)
+        if limiter is not None:
+            key = ratelimit.fingerprint(
+                (e.__class__, e, e.__traceback__), self.__class__.__name__,
+                self.sentry_client.include_paths,
+                self.sentry_client.exclude_paths)
+            if not limiter.admit(key):
+                if recorder is not None:
+                    recorder.increment(metrics.RATE_LIMITED)
+                return super()._handle_request_exception(e)
+
+        pool = getattr(self.sentry_client, 'worker_pool', None)
+        if pool is not None:
+            exc_info = (e.__class__, e, e.__traceback__)
+            event_snapshot = self._take_sentry_snapshot()
+            limits = getattr(self.sentry_client, 'snapshot_limits', None)
+            if limits is not None:  # release the traceback while queued
+                exc_info = snapshot.snapshot_exception(
+                    exc_info, limits, self.sentry_client.frame_limits,
+                    self.sentry_client.capture_locals)
+                event_snapshot = _release_snapshot(event_snapshot, limits)
+            pool.submit(exc_info, functools.partial(_build_event_kwargs,
+                                                    event_snapshot))
+        else:
+            self.sentry_client.captureException(
+                **self._build_sentry_kwargs())
+        if recorder is not None:
+            recorder.observe(metrics.HANDLE_SECONDS,
+                             time.perf_counter() - started)
 
         super()._handle_request_exception(e)
 
 
+@functools.lru_cache(maxsize=None)
+def _handler_name(handler_class):
+    return '{0}.{1}'.format(__name__, handler_class.__name__)
+
+
+_EventSnapshot = collections.namedtuple(
+    '_EventSnapshot', ['client', 'extra', 'tags', 'request', 'crumbs',
+                       'duration', 'sanitize_env'])
+
+
+def _release_snapshot(event_snapshot, limits):
+    """
+    Bound the extra values of `event_snapshot` and release the handler.
+
+    The environment is reported from the cached snapshot, so resolving
+    it here is cheap and lets the handler's sanitizer be dropped.
+
+    """
+    extra = limits.snapshot_mapping(event_snapshot.extra)
+    if 'env' not in event_snapshot.extra:
+        env = getattr(event_snapshot.client, 'environ_snapshot',
+                      _environ_snapshot)
+        extra['env'] = env.get(event_snapshot.sanitize_env)
+    return event_snapshot._replace(extra=extra, sanitize_env=None)
+
+
+def _build_event_kwargs(snapshot):
+    """
+    Build the keyword parameters for capturing an event.
+
+    This only reads from `snapshot`, so it can run on a worker thread
+    while the handler finishes the request.
+
+    """
+    client, extra = snapshot.client, snapshot.extra
+    kwargs = {'extra': extra, 'time_spent': snapshot.duration}
+    if 'env' not in extra:
+        env = getattr(client, 'environ_snapshot', _environ_snapshot)
+        extra['env'] = env.get(snapshot.sanitize_env)
+    request = snapshot.request
+    if request is not None:
+        body = payload.capture_body(
+            request.body, request.headers.get('Content-Type'),
+            getattr(client, 'body_capture', payload.BODY_FULL),
+            getattr(client, 'body_limit', None))
+        kwargs['data'] = {
+            'request': {
+                'url': request.full_url(),
+                'method': request.method,
+                'data': body,
+                'query_string': request.query,
+                'cookies': request.headers.get('Cookie', {}),
+                'headers': dict(request.headers)},
+            'logger': 'sprockets.mixins.sentry'}
+        extra['http_host'] = request.host
+        extra['remote_ip'] = request.remote_ip
+        budget = getattr(client, 'payload_budget', None)
+        if budget is not None:
+            kwargs['extra'] = payload.trim(kwargs['data']['request'],
+                                           extra, budget)
+
+    if snapshot.crumbs is not None and len(snapshot.crumbs):
+        kwargs.setdefault('data', {})['breadcrumbs'] = \
+            snapshot.crumbs.as_payload()
+
+    if snapshot.tags:
+        kwargs.update({'tags': snapshot.tags})
+    return kwargs
+
+
+def _build_slow_request_kwargs(snapshot, handler_name, slow_request):
+    """Build the keyword parameters for reporting a slow request."""
+    kwargs = _build_event_kwargs(snapshot)
+    kwargs['extra']['slow_request'] = slow_request
+    kwargs.setdefault('data', {})['fingerprint'] = ['slow-request',
+                                                    handler_name]
+    kwargs['level'] = logging.WARNING
+    return kwargs
+
+
 def install(application, **kwargs):
     """
     Call this to install a sentry client into a Tornado application.
@@ -185,13 +462,179 @@ def install(application, **kwargs):
 
     - **release** the version of the application that is running
 
+    The following parameters are consumed by this function instead of
+    being passed to raven:
+
+    - **tornado_transport** set this to :data:`True` or to a :class:`dict`
+      of :class:`.TornadoTransport` parameters to queue events in memory
+      and deliver them in batches from the IOLoop.  The queue is bounded by
+      ``max_queue_size`` and ``overflow`` selects whether the oldest
+      (:data:`DROP_OLDEST`) or the newest (:data:`DROP_NEWEST`) event
+      is discarded when it is full.  Await :meth:`.Client.flush` before
+      stopping the IOLoop to deliver anything that is still queued.
+
+    - **spool** a directory name or a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.spool.Spool` parameters.  Events
+      that cannot be delivered are appended to segment files in the
+      directory and replayed at a capped rate once Sentry is reachable
+      again.  Events that are left in the spool when the process exits
+      are replayed once the client is created again.  Spooled events are
+      written to disk synchronously on the IOLoop during an outage.  This
+      implies **tornado_transport**.
+
+    - **forwarder** path of the socket that a
+      :class:`~sprockets.mixins.sentry.forwarder.Forwarder` listens on.
+      Events are handed to the forwarder process instead of being
+      delivered by each worker, and are delivered directly whenever the
+      forwarder is unavailable.  This implies **tornado_transport**.
+
+    - **rate_limit** set this to :data:`True` or to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.ratelimit.RateLimiter` parameters
+      to suppress repeats of the same exception.  Exceptions are
+      fingerprinted by type, innermost application frame, and handler
+      class and each fingerprint gets its own token bucket.  Suppressed
+      exceptions are reported later in a single summary event.
+
+    - **circuit_breaker** set this to :data:`True` or to a :class:`dict`
+      of :class:`~sprockets.mixins.sentry.circuit.CircuitBreaker`
+      parameters to stop capturing events after consecutive delivery
+      failures or slow deliveries.  While the circuit is open, exceptions
+      are only counted.  Probes are let through after a jittered,
+      exponentially increasing delay.  The breaker is available as
+      ``get_client(application).circuit_breaker``.
+
+    - **metrics** a :class:`~sprockets.mixins.sentry.metrics.Metrics`
+      implementation such as
+      :class:`~sprockets.mixins.sentry.metrics.StatsdMetrics` that
+      records how long reporting takes, how large events are, and how
+      many events are sent, dropped, sampled out, or rate limited.
+      Nothing is measured by default.
+
+    - **breadcrumbs** set this to :data:`True`, to the number of
+      breadcrumbs to retain per request, or to a :class:`dict` of
+      ``size``, ``level``, and ``http`` to record log records and
+      outbound :class:`~tornado.httpclient.AsyncHTTPClient` requests
+      made while handling a request.  They are attached to the event
+      when the request fails.  Log records are captured as they are
+      created without adding a handler, so the configuration of the
+      root logger is left alone.  Outbound requests are captured by
+      replacing :meth:`~tornado.httpclient.AsyncHTTPClient.fetch` for
+      the whole process unless ``http`` is :data:`False`.  See
+      :mod:`sprockets.mixins.sentry.breadcrumbs`.
+
+    - **slow_requests** a number of seconds, a
+      :class:`~sprockets.mixins.sentry.slow.SlowRequestPolicy`, or a
+      :class:`dict` of its parameters.  Requests that take longer than
+      the threshold for their route are reported as warnings that
+      include a breakdown of where the time went.  Reports are sampled
+      and rate limited per handler and are delivered like exceptions.
+      Requests that raise are never reported as slow, even when their
+      exception is sampled out or rate limited.  Mark sections of a
+      request with :meth:`SentryMixin.sentry_span`.
+
+    - **stall_detector** set this to :data:`True` or to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.watchdog.StallDetector` parameters
+      to report callbacks that block the current IOLoop for longer than
+      ``threshold`` seconds, along with the stack of the blocking code.
+      A daemon thread watches the IOLoop, so install the client after
+      forking worker processes.
+
+    - **http_errors** set this to :data:`True` or to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.httperrors.HTTPErrorAggregator`
+      parameters to count error responses, including
+      :exc:`~tornado.web.HTTPError`, per handler class and send one
+      summary event per window for the handlers whose error count and
+      error ratio cross the thresholds.
+
+    - **background_errors** set this to :data:`True` or to a :class:`dict`
+      of :class:`~sprockets.mixins.sentry.background.BackgroundErrorReporter`
+      parameters to report exceptions raised by IOLoop callbacks,
+      spawned coroutines, periodic callbacks, and :mod:`asyncio` tasks
+      whose exceptions are never retrieved.  Repeats are rate limited.
+      The reporter hooks the current IOLoop when the client is created.
+
+    - **frame_limits** set this to :data:`True` or to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.frames.FrameLimits` parameters to
+      capture the locals of only the innermost frames, with a bounded
+      number of variables and representation length for each.
+
+    - **worker_pool** set this to :data:`True` or to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.workers.WorkerPool` parameters to
+      build, sanitize, and encode the events of :class:`.SentryMixin` on
+      worker threads.  Only a snapshot of the request is taken on the
+      IOLoop and events are dropped when ``max_pending`` events are
+      already waiting.  Do not modify :attr:`.SentryMixin.sentry_tags`
+      after an exception is raised, or
+      :attr:`.SentryMixin.sentry_extra` when **snapshots** is disabled.
+
+    - **snapshots** copies the frame locals and
+      :attr:`.SentryMixin.sentry_extra` values of events that are queued
+      for the **worker_pool** into bounded representations as soon as
+      the exception is handled, so that the traceback and everything
+      that its frames refer to are released while the event waits.
+      This is enabled by default.  Set it to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.snapshot.SnapshotLimits`
+      parameters to change the limits or to :data:`False` to queue the
+      traceback itself.
+
+    - **preserialize** serializes the fields that every event shares,
+      such as the server name, release, and module versions, once and
+      splices them into each event.  This is enabled by default.
+
+    - **profiling** set this to :data:`True` or to a :class:`dict` of
+      :class:`~sprockets.mixins.sentry.profiler.SamplingProfiler`
+      parameters to sample the stacks of a fraction of requests.  The
+      aggregated stacks are reported in the ``profile`` extra value when
+      the request raises or is reported as slow.
+
+    - **serializer** selects how events are serialized: ``'json'`` (the
+      default), ``'orjson'``, ``'auto'`` to use :mod:`orjson` when it is
+      installed, or a serializer instance.  See
+      :mod:`sprockets.mixins.sentry.serializer`.
+
+    - **compress_level** sets the :mod:`zlib` compression level of events.
+
+    - **compress_threshold** sends events that serialize to fewer bytes
+      than this uncompressed and without a ``Content-Encoding`` header.
+
+    - **sampling** a :class:`~sprockets.mixins.sentry.sampling.SamplingPolicy`
+      or a :class:`dict` of its parameters that selects the fraction of
+      exceptions to report by route and exception class.  Handlers can
+      override the rate with the
+      :attr:`~SentryMixin.sentry_sample_rate` class attribute.  Exceptions
+      that are not sampled are discarded before a payload is built.
+
+    - **body_capture** selects how much of the request body is reported.
+      ``'full'`` reports the entire body and is the default, ``'off'``
+      never reports it, ``'truncate'`` reports the first and last
+      **body_limit** bytes, and ``'text'`` does the same for textual
+      and JSON bodies only.
+
+    - **payload_budget** approximate number of bytes that the request
+      body, headers, and extra data may occupy.  The largest of these
+      are trimmed before the event is built when the budget is exceeded.
+
+    - **defer** set this to :data:`True` to create the client, and import
+      :mod:`raven`, when :func:`get_client` is first called instead of
+      in this function.  A callback that creates it is added to the
+      current IOLoop, so the client is usually created as soon as the
+      IOLoop starts rather than by the first failing request.  The
+      client is not available as ``application.sentry_client`` until
+      it is created, so use :func:`get_client` to retrieve it.
+
+    - **env_include** and **env_exclude** lists of :mod:`fnmatch` patterns
+      that select which environment variables are reported.  Every
+      variable is reported by default.  The sanitized environment is
+      cached and only rebuilt when :data:`os.environ` changes.
+
     See `the raven documentation`_ for additional information.
 
     .. _the raven documentation: https://docs.getsentry.com/hosted/clients/
        python/advanced/#client-arguments
 
     """
-    if get_client(application) is not None:
+    if (getattr(application, SENTRY_CLIENT_FACTORY, None) is not None
+            or get_client(application) is not None):
         LOGGER.warning('sentry client is already installed')
         return False
 
@@ -201,7 +644,7 @@ def install(application, **kwargs):
         if not _sentry_warning_issued:
             LOGGER.info('sentry DSN not found, not installing client')
             _sentry_warning_issued = True
-        setattr(application, 'sentry_client', None)
+        setattr(application, SENTRY_CLIENT, None)
         return False
 
     # ``include_paths`` has two purposes:
@@ -221,12 +664,54 @@ def install(application, **kwargs):
     if os.environ.get('ENVIRONMENT'):
         kwargs.setdefault('environment', os.environ['ENVIRONMENT'])
 
-    client = raven.Client(sentry_dsn, **kwargs)
-    setattr(application, 'sentry_client', client)
+    if kwargs.pop('defer', False):
+        setattr(application, SENTRY_CLIENT_FACTORY,
+                functools.partial(_create_client, sentry_dsn, kwargs))
+        ioloop.IOLoop.current().add_callback(get_client, application)
+        return True
 
+    setattr(application, SENTRY_CLIENT, _create_client(sentry_dsn, kwargs))
     return True
 
 
+def _create_client(sentry_dsn, kwargs):
+    from sprockets.mixins.sentry import forwarder, spool, transport
+    from sprockets.mixins.sentry.client import Client
+
+    kwargs = dict(kwargs)
+    tornado_transport = kwargs.pop('tornado_transport', None)
+    if tornado_transport is True:
+        tornado_transport = {}
+    elif not tornado_transport:
+        tornado_transport = None
+    spool_options = kwargs.pop('spool', None)
+    if spool_options:
+        if isinstance(spool_options, str):
+            spool_options = {'path': spool_options}
+        tornado_transport = dict(tornado_transport or {})
+        tornado_transport['spool'] = spool.Spool(**spool_options)
+    forwarder_path = kwargs.pop('forwarder', None)
+    if forwarder_path:
+        tornado_transport = dict(tornado_transport or {})
+        tornado_transport['forwarder_path'] = forwarder_path
+        kwargs['transport'] = functools.partial(
+            forwarder.ForwardingTransport, **tornado_transport)
+    elif tornado_transport is not None:
+        kwargs['transport'] = functools.partial(transport.TornadoTransport,
+                                                **tornado_transport)
+
+    client = Client(sentry_dsn, **kwargs)
+    client.get_event_skeleton()  # computed once instead of per event
+    event_transport = client.remote.get_transport()
+    if isinstance(event_transport, transport.TornadoTransport):
+        event_transport.start()  # replay what a previous process spooled
+    if client.stall_detector is not None:
+        client.stall_detector.start()
+    if client.background_reporter is not None:
+        client.background_reporter.start()
+    return client
+
+
 def get_client(application):
     """
     Retrieve the sentry client for `application`.
@@ -236,8 +721,18 @@ def get_client(application):
     :returns: a :class:`raven.base.Client` instance or :data:`None`
     :rtype: raven.base.Client
 
+    A client that was installed with ``defer=True`` is created by the
+    first call.
+
     """
     try:
         return application.sentry_client
     except AttributeError:
+        pass
+    factory = getattr(application, SENTRY_CLIENT_FACTORY, None)
+    if factory is None:
         return None
+    delattr(application, SENTRY_CLIENT_FACTORY)
+    client = factory()
+    setattr(application, SENTRY_CLIENT, client)
+    return client
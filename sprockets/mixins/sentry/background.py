@@ -0,0 +1,283 @@
+"""
+sprockets.mixins.sentry.background
+
+Report exceptions that are raised outside of request handlers.
+
+"""
+import asyncio
+import functools
+import logging
+import os
+import sys
+
+from tornado import ioloop
+
+from sprockets.mixins.sentry import metrics, ratelimit
+
+LOGGER = logging.getLogger(__name__)
+
+CALLBACK_MESSAGE = 'Exception in callback %r'
+"""The message that Tornado 5 and 6 log when a callback raises."""
+
+SOURCE_ASYNCIO = 'asyncio'
+SOURCE_CALLBACK = 'callback'
+SOURCE_PERIODIC_CALLBACK = 'periodic_callback'
+SOURCE_TASK = 'task'
+
+_PERIODIC_RUN_CODE = ioloop.PeriodicCallback._run.__code__
+
+
+class BackgroundErrorReporter:
+    """
+    Capture exceptions from IOLoop callbacks and background tasks.
+
+    :param client: the :class:`~sprockets.mixins.sentry.client.Client`
+        to report exceptions with
+    :param bool asyncio_handler: install an exception handler on the
+        asyncio event loop that reports the exceptions of tasks that
+        were never retrieved and of failing :mod:`asyncio` callbacks
+    :param bool callbacks: report the exceptions that Tornado logs for
+        callbacks, spawned coroutines, and periodic callbacks
+    :param float rate: events allowed per second for each fingerprint
+    :param int burst: events allowed for a fingerprint before `rate`
+        applies
+    :param int max_fingerprints: maximum number of fingerprints that are
+        rate limited individually
+    :param float summary_interval: seconds between summaries of the
+        events that were suppressed
+
+    Nothing wraps the tasks or callbacks themselves, so there is no
+    overhead until something fails.  Tornado logs the exceptions of
+    :meth:`~tornado.ioloop.IOLoop.spawn_callback`,
+    :meth:`~tornado.ioloop.IOLoop.add_callback`, and
+    :class:`~tornado.ioloop.PeriodicCallback` to the
+    ``tornado.application`` logger, so a :class:`logging.Handler` on
+    that logger reports them.  :mod:`asyncio` hands the exceptions that
+    nobody retrieved to the event loop's exception handler, which is
+    replaced with one that reports them and then calls the previous
+    handler.
+
+    Events are fingerprinted with
+    :func:`~sprockets.mixins.sentry.ratelimit.fingerprint` using the
+    name of the task or callback and pass through a
+    :class:`~sprockets.mixins.sentry.ratelimit.RateLimiter`, so a
+    periodic callback that fails every time it runs does not flood the
+    transport.  They are also discarded while the client's circuit
+    breaker is open.  The ``source`` tag and the ``task``,
+    ``coroutine``, ``callback``, and ``origin`` extra values describe
+    where the exception came from.
+
+    .. attribute:: captured
+
+       Number of exceptions that were reported.
+
+    """
+
+    def __init__(self, client, asyncio_handler=True, callbacks=True,
+                 rate=1.0 / 60.0, burst=5, max_fingerprints=1000,
+                 summary_interval=60.0):
+        self.client = client
+        self.asyncio_handler = asyncio_handler
+        self.callbacks = callbacks
+        self.captured = 0
+        self.rate_limiter = ratelimit.RateLimiter(
+            client, rate=rate, burst=burst,
+            max_fingerprints=max_fingerprints,
+            summary_interval=summary_interval)
+        self._log_handler = None
+        self._event_loop = None
+        self._previous_handler = None
+
+    @property
+    def running(self):
+        return self._log_handler is not None or self._event_loop is not None
+
+    @property
+    def suppressed(self):
+        """Number of exceptions that were rate limited."""
+        return self.rate_limiter.suppressed
+
+    def start(self):
+        """Start reporting for the current IOLoop."""
+        if self.running:
+            return
+        if self.callbacks:
+            self._log_handler = _CallbackErrorHandler(self)
+            logging.getLogger('tornado.application').addHandler(
+                self._log_handler)
+        if self.asyncio_handler:
+            event_loop = ioloop.IOLoop.current().asyncio_loop
+            self._previous_handler = event_loop.get_exception_handler()
+            event_loop.set_exception_handler(self._handle_asyncio_error)
+            self._event_loop = event_loop
+
+    def stop(self):
+        """Stop reporting and restore the previous exception handler."""
+        if self._log_handler is not None:
+            logging.getLogger('tornado.application').removeHandler(
+                self._log_handler)
+            self._log_handler = None
+        if self._event_loop is not None:
+            self._event_loop.set_exception_handler(self._previous_handler)
+            self._event_loop = self._previous_handler = None
+
+    def capture(self, exc_info, source, context):
+        """
+        Report an exception unless it is rate limited.
+
+        :param exc_info: the ``(type, value, traceback)`` of the exception
+        :param str source: one of the ``SOURCE_`` constants
+        :param dict context: extra values that describe the origin.  The
+            ``task`` or ``callback`` value names the fingerprint.
+        :returns: :data:`True` if the exception was reported
+        :rtype: bool
+
+        """
+        client, recorder = self.client, self.client.metrics
+        breaker = client.circuit_breaker
+        if breaker is not None and not breaker.allow(probe=False):
+            if recorder is not None:
+                recorder.increment(metrics.SHORT_CIRCUITED)
+            return False
+        name = context.get('task') or context.get('callback') or source
+        key = ratelimit.fingerprint(exc_info, name, client.include_paths,
+                                    client.exclude_paths)
+        if not self.rate_limiter.admit(key):
+            if recorder is not None:
+                recorder.increment(metrics.RATE_LIMITED)
+            return False
+        self.captured += 1
+        client.captureException(
+            exc_info=exc_info, extra=dict(context),
+            tags={'source': source},
+            data={'logger': 'sprockets.mixins.sentry.background'})
+        return True
+
+    def _handle_asyncio_error(self, event_loop, context):
+        try:
+            exception = context.get('exception')
+            if isinstance(exception, Exception):
+                future = context.get('future') or context.get('task')
+                if future is not None:
+                    source, origin = SOURCE_TASK, describe_future(future)
+                else:
+                    source = SOURCE_ASYNCIO
+                    origin = describe_callback(
+                        getattr(context.get('handle'), '_callback', None))
+                if context.get('source_traceback'):
+                    created = context['source_traceback'][-1]
+                    origin['created_at'] = '{0}:{1}'.format(
+                        created.filename, created.lineno)
+                origin['message'] = context.get('message')
+                self.capture((exception.__class__, exception,
+                              exception.__traceback__), source, origin)
+        except Exception:
+            LOGGER.exception('failed to report asyncio error')
+        finally:
+            if self._previous_handler is not None:
+                self._previous_handler(event_loop, context)
+            else:
+                event_loop.default_exception_handler(context)
+
+
+class _CallbackErrorHandler(logging.Handler):
+    """Report the callback errors that Tornado logs."""
+
+    def __init__(self, reporter):
+        super().__init__()
+        self.reporter = reporter
+
+    def emit(self, record):
+        if record.msg != CALLBACK_MESSAGE or not record.exc_info or \
+                not record.args:
+            return
+        if ioloop.IOLoop.current(instance=False) is None:
+            return
+        try:
+            callback = record.args[0]
+            future = _spawned_future(callback)
+            if future is not None:
+                source, origin = SOURCE_TASK, describe_future(future)
+            else:
+                source = SOURCE_CALLBACK
+                if _in_periodic_callback():
+                    source = SOURCE_PERIODIC_CALLBACK
+                origin = describe_callback(callback)
+            self.reporter.capture(record.exc_info, source, origin)
+        except Exception:
+            LOGGER.exception('failed to report callback error')
+
+
+def describe_future(future):
+    """
+    Describe where a failed task came from.
+
+    :param future: the :class:`asyncio.Future` or :class:`asyncio.Task`
+    :returns: a :class:`dict` with the ``task`` name and the
+        ``coroutine`` and its ``origin`` when `future` is a task
+
+    """
+    description = {'task': repr(future)}
+    if isinstance(future, asyncio.Task):
+        if hasattr(future, 'get_name'):  # task names are Python 3.8+
+            description['task'] = future.get_name()
+        if hasattr(future, 'get_coro'):
+            coro = future.get_coro()
+        else:
+            coro = getattr(future, '_coro', None)
+        code = getattr(coro, 'cr_code', None) or getattr(coro, 'gi_code',
+                                                         None)
+        description['coroutine'] = getattr(coro, '__qualname__', repr(coro))
+        if code is not None:
+            description['origin'] = _location(code)
+    return description
+
+
+def describe_callback(callback):
+    """
+    Describe a callback that raised.
+
+    :param callback: the callable, which may be a
+        :func:`functools.partial`
+    :returns: a :class:`dict` with the ``callback`` name and its
+        ``origin`` when it is implemented in Python
+
+    """
+    while isinstance(callback, functools.partial):
+        callback = callback.func
+    if callback is None:
+        return {}
+    function = getattr(callback, '__func__', callback)
+    name = getattr(function, '__qualname__', None)
+    module = getattr(function, '__module__', None)
+    description = {'callback': '{0}.{1}'.format(module, name)
+                   if name and module else repr(callback)}
+    code = getattr(function, '__code__', None)
+    if code is not None:
+        description['origin'] = _location(code)
+    return description
+
+
+def _spawned_future(callback):
+    # spawn_callback runs coroutines through IOLoop.add_future with a
+    # partial of _discard_future_result that raises the task's exception
+    if not isinstance(callback, functools.partial) or not callback.args:
+        return None
+    if getattr(callback.func, '__name__', None) != '_discard_future_result':
+        return None
+    future = callback.args[0]
+    return future if asyncio.isfuture(future) else None
+
+
+def _in_periodic_callback():
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code is _PERIODIC_RUN_CODE:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _location(code):
+    return '{0}:{1}'.format(os.path.basename(code.co_filename),
+                            code.co_firstlineno)
@@ -0,0 +1,248 @@
+"""
+sprockets.mixins.sentry.breadcrumbs
+
+Record what a request did before it failed.
+
+Each request handled by :class:`~sprockets.mixins.sentry.SentryMixin`
+gets its own :class:`Recorder` through a :mod:`contextvars` variable, so
+log records and outbound HTTP requests are attributed to the request
+that made them even when many requests are interleaved on the IOLoop.
+Breadcrumbs are stored as plain tuples in a fixed-size ring and are
+only formatted when an exception is reported.
+
+"""
+import collections
+import contextvars
+import logging
+import time
+
+from tornado import httpclient
+
+MESSAGE_MAX_LENGTH = 1024
+"""Formatted messages are truncated to this many characters."""
+
+Breadcrumb = collections.namedtuple(
+    'Breadcrumb', ['timestamp', 'type', 'category', 'level', 'message',
+                   'args'])
+Breadcrumb.__doc__ = """
+A recorded breadcrumb.
+
+Breadcrumbs are appended to the ring as plain tuples with these fields
+and are only converted to this type when they are read.  `message` and
+`args` are formatted with the ``%`` operator like log records, except
+for ``http`` breadcrumbs whose `args` are the method, URL, status code,
+and duration of the request.
+
+"""
+
+_current = contextvars.ContextVar('sprockets.mixins.sentry.breadcrumbs',
+                                  default=None)
+_level = None
+_previous_factory = None
+_original_fetch = None
+
+
+class Recorder:
+    """
+    Fixed-size ring of breadcrumbs for a single request.
+
+    :param int size: maximum number of breadcrumbs to retain.  Older
+        breadcrumbs are overwritten once the ring is full.
+
+    The ring is allocated by the first breadcrumb, so requests that
+    neither log nor make HTTP requests only pay for this object.
+
+    .. attribute:: count
+
+       Number of breadcrumbs recorded, including overwritten ones.
+
+    """
+
+    __slots__ = ('size', 'count', '_ring')
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._ring = None
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, crumb):
+        """Append a :class:`Breadcrumb` shaped tuple."""
+        if self._ring is None:
+            self._ring = [None] * self.size
+        self._ring[self.count % self.size] = crumb
+        self.count += 1
+
+    @property
+    def dropped(self):
+        """Number of breadcrumbs that were overwritten."""
+        return max(0, self.count - self.size)
+
+    def breadcrumbs(self):
+        """Return the retained breadcrumbs from oldest to newest."""
+        if self._ring is None:
+            return []
+        if self.count <= self.size:
+            crumbs = self._ring[:self.count]
+        else:
+            start = self.count % self.size
+            crumbs = self._ring[start:] + self._ring[:start]
+        return [Breadcrumb._make(crumb) for crumb in crumbs]
+
+    def as_payload(self):
+        """Format the breadcrumbs for the Sentry breadcrumbs interface."""
+        return {'values': [_format(crumb) for crumb in self.breadcrumbs()]}
+
+
+def activate(size):
+    """
+    Start recording breadcrumbs in the current context.
+
+    :param int size: maximum number of breadcrumbs to retain
+    :rtype: Recorder
+
+    """
+    recorder = Recorder(size)
+    _current.set(recorder)
+    return recorder
+
+
+def deactivate():
+    """
+    Stop recording breadcrumbs in the current context.
+
+    :returns: the :class:`Recorder` that was active or :data:`None`
+
+    """
+    recorder = _current.get()
+    if recorder is not None:
+        _current.set(None)
+    return recorder
+
+
+def current():
+    """Return the :class:`Recorder` for the current context or None."""
+    return _current.get()
+
+
+def record(message, *args, category='default', level='info'):
+    """
+    Record a breadcrumb for the current request.
+
+    :param str message: the message, formatted with `args` when the
+        breadcrumb is reported
+    :param str category: groups related breadcrumbs
+    :param str level: ``debug``, ``info``, ``warning``, ``error``, or
+        ``critical``
+
+    This is a no-op outside of a request.
+
+    """
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.append((time.time(), 'default', category, level, message,
+                         args))
+
+
+def enable(level=logging.INFO, http=True):
+    """
+    Feed breadcrumbs from log records and from outbound requests.
+
+    :param int level: minimum level of the log records to record
+    :param bool http: record requests made with
+        :class:`tornado.httpclient.AsyncHTTPClient`
+
+    Log records are recorded as they are created by wrapping the
+    :func:`logging.setLogRecordFactory` factory, so the handlers of the
+    root logger, :data:`logging.lastResort`, and
+    :func:`logging.basicConfig` are unaffected.  Records of loggers that
+    are not enabled for their level are never created and so are not
+    recorded.  Outbound requests are recorded by replacing
+    :meth:`tornado.httpclient.AsyncHTTPClient.fetch` for the whole
+    process.
+
+    This is called by :class:`~sprockets.mixins.sentry.Client` and is
+    safe to call more than once.
+
+    """
+    global _level, _previous_factory, _original_fetch
+    if _previous_factory is None:
+        _previous_factory = logging.getLogRecordFactory()
+        logging.setLogRecordFactory(_make_record)
+    _level = level if _level is None else min(level, _level)
+    if http and _original_fetch is None:
+        _original_fetch = httpclient.AsyncHTTPClient.fetch
+        httpclient.AsyncHTTPClient.fetch = _fetch
+
+
+def disable():
+    """Undo :func:`enable`."""
+    global _level, _previous_factory, _original_fetch
+    _level = None
+    # a factory installed after ours still calls it, so it stays in
+    # place and passes records through until it is enabled again
+    if logging.getLogRecordFactory() is _make_record:
+        logging.setLogRecordFactory(_previous_factory)
+        _previous_factory = None
+    if _original_fetch is not None:
+        httpclient.AsyncHTTPClient.fetch = _original_fetch
+        _original_fetch = None
+
+
+def _make_record(*args, **kwargs):
+    record = _previous_factory(*args, **kwargs)
+    if _level is not None and record.levelno >= _level:
+        recorder = _current.get()
+        if recorder is not None:
+            recorder.append((record.created, 'default', record.name,
+                             record.levelname, record.msg, record.args))
+    return record
+
+
+def _fetch(self, request, *args, **kwargs):
+    future = _original_fetch(self, request, *args, **kwargs)
+    recorder = _current.get()
+    if recorder is not None:
+        if isinstance(request, httpclient.HTTPRequest):
+            method, url = request.method, request.url
+        else:
+            method, url = kwargs.get('method', 'GET'), request
+        started = time.time()
+
+        def on_done(future):
+            error = None if future.cancelled() else future.exception()
+            if error is None:
+                code = None if future.cancelled() else future.result().code
+            else:
+                code = getattr(error, 'code', None)
+            recorder.append((started, 'http', 'http',
+                             'error' if error is not None else 'info',
+                             None, (method, url, code,
+                                    time.time() - started)))
+
+        future.add_done_callback(on_done)
+    return future
+
+
+def _format(crumb):
+    timestamp, crumb_type, category, level, message, args = crumb
+    data = None
+    if crumb_type == 'http':
+        method, url, code, duration = args
+        data = {'method': method, 'url': url, 'status_code': code,
+                'duration': round(duration, 6)}
+        message = None
+    elif args:
+        try:
+            message = str(message) % args
+        except Exception:  # mirror logging, which never raises
+            message = '{0} {1!r}'.format(message, args)
+    elif message is not None:
+        message = str(message)
+    if message is not None:
+        message = message[:MESSAGE_MAX_LENGTH]
+    return {'type': crumb_type, 'timestamp': timestamp,
+            'category': category, 'level': level.lower(),
+            'message': message, 'data': data}
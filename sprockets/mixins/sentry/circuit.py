@@ -0,0 +1,133 @@
+"""
+sprockets.mixins.sentry.circuit
+
+Stop capturing events while Sentry is failing.
+
+"""
+import logging
+import random
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+"""Events are captured and delivered normally."""
+
+OPEN = 'open'
+"""Events are discarded without being captured."""
+
+HALF_OPEN = 'half-open'
+"""A single probe event is being delivered to test Sentry."""
+
+
+class CircuitBreaker:
+    """
+    Track delivery failures and short-circuit capture while they persist.
+
+    :param int failure_threshold: consecutive failed deliveries that
+        open the circuit.
+    :param float latency_threshold: deliveries that take longer than
+        this many seconds count as failures.  Latency is ignored when
+        this is :data:`None`.
+    :param float base_delay: seconds to wait before the first probe.
+    :param float max_delay: upper bound on the wait between probes.
+    :param float jitter: fraction of the delay that is randomized so
+        that processes do not probe in lock step.
+    :param float probe_timeout: seconds to wait for the outcome of a
+        probe before allowing another one.
+
+    The circuit starts :data:`CLOSED`.  After `failure_threshold`
+    consecutive failures it opens and every event is discarded, which
+    costs a counter increment.  Once the delay has elapsed the next event
+    is let through as a probe (:data:`HALF_OPEN`).  A successful probe
+    closes the circuit and a failed one re-opens it with the delay
+    doubled, up to `max_delay`.
+
+    .. attribute:: short_circuited
+
+       Number of events discarded because the circuit was open.
+
+    """
+
+    def __init__(self, failure_threshold=5, latency_threshold=None,
+                 base_delay=1.0, max_delay=300.0, jitter=0.5,
+                 probe_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.probe_timeout = probe_timeout
+        self.consecutive_failures = 0
+        self.short_circuited = 0
+        self._state = CLOSED
+        self._opened = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    @property
+    def state(self):
+        """One of :data:`CLOSED`, :data:`OPEN`, or :data:`HALF_OPEN`."""
+        return self._state
+
+    def allow(self, probe=True):
+        """
+        Should an event be captured?
+
+        :param bool probe: start a probe if the circuit is ready for one.
+            Pass :data:`False` to check without changing the state.
+        :rtype: bool
+
+        """
+        if self._state == CLOSED:
+            return True
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if time.monotonic() >= self._retry_at:
+                if probe:
+                    self._state = HALF_OPEN
+                    self._retry_at = time.monotonic() + self.probe_timeout
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self, latency=None):
+        """Record a delivery that took `latency` seconds."""
+        if self.latency_threshold is not None and latency is not None \
+                and latency > self.latency_threshold:
+            return self.record_failure()
+        with self._lock:
+            self.consecutive_failures = 0
+            if self._state != CLOSED:
+                LOGGER.info('sentry delivery recovered, closing circuit')
+                self._state = CLOSED
+                self._opened = 0
+
+    def record_failure(self):
+        """Record a failed or slow delivery."""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self._state == HALF_OPEN or (
+                    self._state == CLOSED and
+                    self.consecutive_failures >= self.failure_threshold):
+                delay = min(self.max_delay,
+                            self.base_delay * (2 ** self._opened))
+                delay *= 1.0 + self.jitter * (self._random.random() * 2 - 1)
+                self._opened += 1
+                self._state = OPEN
+                self._retry_at = time.monotonic() + delay
+                LOGGER.warning('sentry delivery is failing, opening circuit '
+                               'for %.1f seconds', delay)
+
+    def as_dict(self):
+        """Describe the breaker for health checks."""
+        retry_in = None
+        if self._state != CLOSED:
+            retry_in = max(0.0, self._retry_at - time.monotonic())
+        return {'state': self._state,
+                'consecutive_failures': self.consecutive_failures,
+                'short_circuited': self.short_circuited,
+                'retry_in': retry_in}
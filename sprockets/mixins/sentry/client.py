@@ -0,0 +1,443 @@
+"""
+sprockets.mixins.sentry.client
+
+The raven client that :func:`sprockets.mixins.sentry.install` creates.
+
+"""
+import json
+import time
+
+import raven
+from raven import breadcrumbs as raven_breadcrumbs
+
+from sprockets.mixins.sentry import (background,
+                                     breadcrumbs as breadcrumbs_module,
+                                     circuit, environ, frames, httperrors,
+                                     metrics as metrics_module, payload,
+                                     profiler, ratelimit,
+                                     serializer as serializer_module,
+                                     skeleton, slow, snapshot, watchdog,
+                                     workers)
+from sprockets.mixins.sentry import sampling as sampling_module
+from sprockets.mixins.sentry import transport as transport_module
+
+
+class Client(raven.Client):
+    """
+    A :class:`raven.base.Client` that cooperates with the IOLoop.
+
+    When the remote transport is a
+    :class:`~sprockets.mixins.sentry.transport.TornadoTransport`, events
+    are handed over without being encoded so that serialization and
+    compression happen when the transport drains its queue instead of
+    while the failing request is being handled.  With any other
+    transport this behaves exactly like :class:`raven.base.Client`.
+
+    :param rate_limit: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.ratelimit.RateLimiter`
+        parameters to deduplicate exceptions captured by
+        :class:`~sprockets.mixins.sentry.SentryMixin`.
+    :param sampling: a
+        :class:`~sprockets.mixins.sentry.sampling.SamplingPolicy` or a
+        :class:`dict` of its parameters to sample exceptions captured by
+        :class:`~sprockets.mixins.sentry.SentryMixin`.
+    :param str body_capture: one of
+        :data:`~sprockets.mixins.sentry.payload.BODY_MODES` that selects
+        how much of the request body is reported.
+    :param int body_limit: maximum number of body bytes to report when
+        `body_capture` truncates the body.
+    :param int payload_budget: approximate number of bytes that the
+        request body, headers, and extra data may occupy together.
+    :param env_include: optional list of patterns that select the
+        environment variables to report.
+    :param env_exclude: optional list of patterns for environment
+        variables that are never reported.
+    :param circuit_breaker: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.circuit.CircuitBreaker`
+        parameters to stop capturing events while delivery is failing.
+    :param metrics: optional :class:`~sprockets.mixins.sentry.metrics.Metrics`
+        implementation that measures the cost of reporting.
+    :param breadcrumbs: :data:`True`, the number of breadcrumbs to
+        retain per request, or a :class:`dict` with ``size``, ``level``,
+        and ``http`` keys.  See
+        :func:`sprockets.mixins.sentry.breadcrumbs.enable`.
+    :param slow_requests: a number of seconds, a
+        :class:`~sprockets.mixins.sentry.slow.SlowRequestPolicy`, or a
+        :class:`dict` of its parameters to report slow requests handled
+        by :class:`~sprockets.mixins.sentry.SentryMixin`.
+    :param stall_detector: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.watchdog.StallDetector`
+        parameters to report code that blocks the IOLoop.  The detector
+        is created but not started.
+    :param http_errors: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.httperrors.HTTPErrorAggregator`
+        parameters to report elevated error rates.
+    :param background_errors: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.background.BackgroundErrorReporter`
+        parameters to report exceptions raised by IOLoop callbacks and
+        background tasks.  The reporter is created but not started.
+    :param serializer: ``'json'``, ``'orjson'``, ``'auto'``, or an object
+        with a ``dumps`` method that returns :class:`bytes`.  See
+        :func:`~sprockets.mixins.sentry.serializer.get_serializer`.
+    :param int compress_level: :mod:`zlib` compression level for events.
+    :param int compress_threshold: events that serialize to fewer bytes
+        than this are sent uncompressed.
+    :param frame_limits: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.frames.FrameLimits` parameters
+        to bound the frame locals that are captured.
+    :param worker_pool: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.workers.WorkerPool` parameters
+        to build the events of
+        :class:`~sprockets.mixins.sentry.SentryMixin` on worker threads.
+    :param profiling: :data:`True` or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.profiler.SamplingProfiler`
+        parameters to profile a fraction of the requests handled by
+        :class:`~sprockets.mixins.sentry.SentryMixin`.
+    :param snapshots: :data:`True`, :data:`False`, or a :class:`dict` of
+        :class:`~sprockets.mixins.sentry.snapshot.SnapshotLimits`
+        parameters.  The exceptions and extra values of events that
+        :class:`~sprockets.mixins.sentry.SentryMixin` queues for the
+        worker pool are copied within these limits so that the
+        traceback is released immediately.
+    :param bool preserialize: serialize the fields of the
+        :class:`~sprockets.mixins.sentry.skeleton.EventSkeleton` once and
+        splice them into every event.
+
+    Exceptions are captured with
+    :class:`sprockets.mixins.sentry.frames.ExceptionEvent`, which reads source
+    context from a process-wide cache.  The fields that every event shares
+    are computed once in an
+    :class:`~sprockets.mixins.sentry.skeleton.EventSkeleton` that is
+    rebuilt when ``include_paths``, ``release``, or the other attributes
+    that it depends on are replaced.
+
+    .. attribute:: circuit_breaker
+
+       The :class:`~sprockets.mixins.sentry.circuit.CircuitBreaker`
+       instance or :data:`None`.  When it is enabled, it replaces the
+       backoff that :class:`raven.base.Client` applies after a failure.
+       Events that the transport spools are not reported to it as
+       failures since they are not lost.
+
+    .. attribute:: metrics
+
+       The :class:`~sprockets.mixins.sentry.metrics.Metrics` instance or
+       :data:`None` if nothing is measured.
+
+    .. attribute:: breadcrumb_size
+
+       Number of breadcrumbs that
+       :class:`~sprockets.mixins.sentry.SentryMixin` retains for each
+       request or :data:`None` if breadcrumbs are not recorded.
+
+    .. attribute:: slow_request_policy
+
+       The :class:`~sprockets.mixins.sentry.slow.SlowRequestPolicy`
+       instance or :data:`None` if slow requests are not reported.
+
+    .. attribute:: stall_detector
+
+       The :class:`~sprockets.mixins.sentry.watchdog.StallDetector`
+       instance or :data:`None`.
+
+    .. attribute:: http_error_aggregator
+
+       The
+       :class:`~sprockets.mixins.sentry.httperrors.HTTPErrorAggregator`
+       instance or :data:`None`.
+
+    .. attribute:: background_reporter
+
+       The
+       :class:`~sprockets.mixins.sentry.background.BackgroundErrorReporter`
+       instance or :data:`None`.
+
+    .. attribute:: event_encoder
+
+       The :class:`~sprockets.mixins.sentry.serializer.Encoder` that
+       turns events into request bodies.
+
+    .. attribute:: frame_limits
+
+       The :class:`~sprockets.mixins.sentry.frames.FrameLimits` instance
+       or :data:`None` if every frame's locals are captured.
+
+    .. attribute:: worker_pool
+
+       The :class:`~sprockets.mixins.sentry.workers.WorkerPool` instance
+       or :data:`None` if events are built on the IOLoop.
+
+    .. attribute:: snapshot_limits
+
+       The :class:`~sprockets.mixins.sentry.snapshot.SnapshotLimits`
+       instance or :data:`None` if queued events keep the traceback.
+
+    .. attribute:: profiler
+
+       The :class:`~sprockets.mixins.sentry.profiler.SamplingProfiler`
+       instance or :data:`None` if requests are not profiled.
+
+    .. attribute:: environ_snapshot
+
+       The :class:`~sprockets.mixins.sentry.environ.EnvironmentSnapshot`
+       that is reported in the ``env`` extra value.
+
+    .. attribute:: rate_limiter
+
+       The :class:`~sprockets.mixins.sentry.ratelimit.RateLimiter`
+       instance or :data:`None` if rate limiting is disabled.
+
+    .. attribute:: sampling_policy
+
+       The :class:`~sprockets.mixins.sentry.sampling.SamplingPolicy`
+       instance or :data:`None` if every exception is reported.
+
+    """
+
+    def __init__(self, *args, rate_limit=None, sampling=None,
+                 body_capture=payload.BODY_FULL, body_limit=4096,
+                 payload_budget=None, env_include=None, env_exclude=None,
+                 circuit_breaker=None, metrics=None, breadcrumbs=None,
+                 slow_requests=None, stall_detector=None, http_errors=None,
+                 serializer='json', compress_level=-1, compress_threshold=0,
+                 frame_limits=None, worker_pool=None, preserialize=True,
+                 profiling=None, background_errors=None, snapshots=True,
+                 **kwargs):
+        if body_capture not in payload.BODY_MODES:
+            raise ValueError(
+                'unknown body capture mode {0!r}'.format(body_capture))
+        self.event_encoder = serializer_module.Encoder(
+            serializer, compress_level, compress_threshold)
+        super().__init__(*args, **kwargs)
+        self.body_capture = body_capture
+        self.body_limit = body_limit
+        self.payload_budget = payload_budget
+        self.environ_snapshot = environ.EnvironmentSnapshot(env_include,
+                                                            env_exclude)
+        self.rate_limiter = None
+        if rate_limit:
+            if rate_limit is True:
+                rate_limit = {}
+            self.rate_limiter = ratelimit.RateLimiter(self, **rate_limit)
+        self.sampling_policy = sampling
+        if isinstance(sampling, dict):
+            self.sampling_policy = sampling_module.SamplingPolicy(**sampling)
+        self.metrics = metrics
+        self.breadcrumb_size = None
+        if breadcrumbs:
+            if breadcrumbs is True:
+                breadcrumbs = {}
+            elif isinstance(breadcrumbs, int):
+                breadcrumbs = {'size': breadcrumbs}
+            breadcrumbs = dict(breadcrumbs)
+            self.breadcrumb_size = breadcrumbs.pop('size', 50)
+            breadcrumbs_module.enable(**breadcrumbs)
+        self.slow_request_policy = slow_requests
+        if slow_requests is True:
+            self.slow_request_policy = slow.SlowRequestPolicy()
+        elif isinstance(slow_requests, dict):
+            self.slow_request_policy = slow.SlowRequestPolicy(**slow_requests)
+        elif isinstance(slow_requests, (int, float)):
+            self.slow_request_policy = slow.SlowRequestPolicy(slow_requests)
+        self.http_error_aggregator = None
+        if http_errors:
+            if http_errors is True:
+                http_errors = {}
+            self.http_error_aggregator = httperrors.HTTPErrorAggregator(
+                self, **http_errors)
+        self.profiler = None
+        if profiling:
+            if profiling is True:
+                profiling = {}
+            self.profiler = profiler.SamplingProfiler(**profiling)
+        self.stall_detector = None
+        if stall_detector:
+            if stall_detector is True:
+                stall_detector = {}
+            self.stall_detector = watchdog.StallDetector(self,
+                                                         **stall_detector)
+        self.background_reporter = None
+        if background_errors:
+            if background_errors is True:
+                background_errors = {}
+            self.background_reporter = background.BackgroundErrorReporter(
+                self, **background_errors)
+        self.frame_limits = None
+        if frame_limits:
+            if frame_limits is True:
+                frame_limits = {}
+            self.frame_limits = frames.FrameLimits(**frame_limits)
+        self._module_versions = None, None
+        self._event_skeleton = None
+        self.preserialize = preserialize
+        self.snapshot_limits = None
+        if snapshots:
+            if snapshots is True:
+                snapshots = {}
+            self.snapshot_limits = snapshot.SnapshotLimits(**snapshots)
+            if snapshot.release_log_exc_info not in \
+                    raven_breadcrumbs.special_logging_handlers:
+                raven_breadcrumbs.register_logging_handler(
+                    snapshot.release_log_exc_info)
+        self.worker_pool = None
+        if worker_pool:
+            if worker_pool is True:
+                worker_pool = {}
+            self.worker_pool = workers.WorkerPool(self, **worker_pool)
+        self.circuit_breaker = None
+        if circuit_breaker:
+            if circuit_breaker is True:
+                circuit_breaker = {}
+            self.circuit_breaker = circuit.CircuitBreaker(**circuit_breaker)
+        transport = self.remote.get_transport()
+        if isinstance(transport, transport_module.TornadoTransport):
+            transport.encoder = self.encode
+            transport.metrics = self.metrics
+
+    def get_handler(self, name):
+        if name == 'raven.events.Exception':
+            name = 'sprockets.mixins.sentry.frames.ExceptionEvent'
+        return super().get_handler(name)
+
+    def get_module_versions(self):
+        include_paths = frozenset(self.include_paths)
+        cached_paths, versions = self._module_versions
+        if versions is None or cached_paths != include_paths:
+            versions = super().get_module_versions()
+            self._module_versions = include_paths, versions
+        return dict(versions)
+
+    def skip_error_for_logging(self, exc_info):
+        if isinstance(exc_info, snapshot.ExceptionSnapshot):
+            return False  # every snapshot is a separate exception
+        return super().skip_error_for_logging(exc_info)
+
+    def record_exception_seen(self, exc_info):
+        if not isinstance(exc_info, snapshot.ExceptionSnapshot):
+            super().record_exception_seen(exc_info)
+
+    def capture(self, event_type, **kwargs):
+        if self.circuit_breaker is not None and \
+                not self.circuit_breaker.allow():
+            return None
+        return super().capture(event_type, **kwargs)
+
+    def get_event_skeleton(self):
+        """
+        Return the fields that every event shares.
+
+        :rtype: sprockets.mixins.sentry.skeleton.EventSkeleton
+
+        """
+        event_skeleton = self._event_skeleton
+        if event_skeleton is None or not event_skeleton.matches(self):
+            event_skeleton = skeleton.EventSkeleton(self)
+            self._event_skeleton = event_skeleton
+        return event_skeleton
+
+    def build_msg(self, event_type, data=None, *args, **kwargs):
+        data = self.get_event_skeleton().apply(dict(data or {}))
+        if self.metrics is None:
+            return super().build_msg(event_type, data, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().build_msg(event_type, data, *args, **kwargs)
+        finally:
+            self.metrics.observe(metrics_module.BUILD_SECONDS,
+                                 time.perf_counter() - started)
+
+    def encode(self, data):
+        encoded = self.event_encoder.encode(
+            data, self._event_skeleton if self.preserialize else None)
+        if self.metrics is not None:
+            self.metrics.observe(metrics_module.EVENT_BYTES, len(encoded))
+        return encoded
+
+    def send(self, auth_header=None, **data):
+        loop = None
+        if self.worker_pool is not None:
+            loop = self.worker_pool.current_loop()
+        if loop is not None:  # built by a worker, send from the IOLoop
+            loop.add_callback(self.send_encoded, self.encode(data),
+                              auth_header=auth_header)
+            return
+        transport = self.remote.get_transport()
+        if isinstance(transport, transport_module.TornadoTransport):
+            return self.send_encoded(data, auth_header=auth_header)
+        return super().send(auth_header=auth_header, **data)
+
+    def send_remote(self, url, data, headers=None):
+        if headers is None:
+            headers = {}
+        if isinstance(data, bytes) and \
+                not serializer_module.is_compressed(data):
+            headers = dict(headers)
+            headers.pop('Content-Encoding', None)
+        breaker, metrics = self.circuit_breaker, self.metrics
+        if breaker is None and metrics is None:
+            return super().send_remote(url, data, headers)
+        if breaker is None and not self.raise_send_errors and \
+                not self.state.should_try():
+            self._log_failed_submission(self.decode(data))
+            return
+        started = time.monotonic()
+
+        def sending():  # the transport's queue wait is not delivery time
+            nonlocal started
+            started = time.monotonic()
+
+        def successful_send():
+            latency = time.monotonic() - started
+            if breaker is not None:
+                breaker.record_success(latency)
+            if metrics is not None:
+                metrics.increment(metrics_module.SENT)
+                metrics.observe(metrics_module.DELIVERY_SECONDS, latency)
+            self._successful_send()
+
+        def failed_send(error):
+            if breaker is not None:
+                breaker.record_failure()
+            if metrics is not None:
+                metrics.increment(metrics_module.FAILED)
+            self._failed_send(error, url, self.decode(data))
+
+        try:
+            transport = self.remote.get_transport()
+            if isinstance(transport, transport_module.TornadoTransport):
+                transport.async_send(url, data, headers, successful_send,
+                                     failed_send, started_cb=sending)
+            elif transport.is_async:
+                transport.async_send(url, data, headers, successful_send,
+                                     failed_send)
+            else:
+                transport.send(url, data, headers)
+                successful_send()
+        except Exception as error:
+            if self.raise_send_errors:
+                raise
+            failed_send(error)
+
+    def decode(self, data):
+        if isinstance(data, dict):  # deferred encoding, see send()
+            return data
+        if not serializer_module.is_compressed(data):
+            return json.loads(data.decode('utf-8'))
+        return super().decode(data)
+
+    async def flush(self, timeout=None):
+        """
+        Wait for queued events to be delivered.
+
+        :param float timeout: optional number of seconds to wait.
+
+        Events that are still being built by the worker pool are waited
+        for as well.  Otherwise, this is a no-op unless the client is
+        using the IOLoop-native transport.
+
+        """
+        if self.worker_pool is not None:
+            await self.worker_pool.join(timeout)
+        transport = self.remote.get_transport()
+        if isinstance(transport, transport_module.TornadoTransport):
+            await transport.flush(timeout)
@@ -0,0 +1,59 @@
+"""
+sprockets.mixins.sentry.environ
+
+Process-wide, sanitized snapshot of the environment.
+
+"""
+import fnmatch
+import os
+
+
+class EnvironmentSnapshot:
+    """
+    Cache a filtered and sanitized copy of :data:`os.environ`.
+
+    :param include: optional list of :mod:`fnmatch` patterns.  Only
+        variables that match one of the patterns are included.
+    :param exclude: optional list of :mod:`fnmatch` patterns.  Variables
+        that match one of the patterns are never included.
+
+    The snapshot is built the first time that :meth:`get` is called and
+    the same :class:`dict` is returned until the environment changes.
+    Callers share the returned value so it must not be modified.
+
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = list(include) if include is not None else None
+        self.exclude = list(exclude or [])
+        self.rebuilds = 0
+        self._source = None
+        self._snapshot = None
+
+    def get(self, sanitize):
+        """
+        Retrieve the snapshot, rebuilding it if the environment changed.
+
+        :param sanitize: called with the filtered :class:`dict` when the
+            snapshot is rebuilt and returns the sanitized version.
+        :rtype: dict
+
+        """
+        # Comparing the raw mapping against a shallow copy is cheap
+        # since unchanged entries are the very same objects.
+        source = getattr(os.environ, '_data', os.environ)
+        if self._snapshot is None or source != self._source:
+            self._source = dict(source)
+            self._snapshot = sanitize(
+                {name: value for name, value in os.environ.items()
+                 if self._is_wanted(name)})
+            self.rebuilds += 1
+        return self._snapshot
+
+    def _is_wanted(self, name):
+        if self.include is not None and not any(
+                fnmatch.fnmatchcase(name, pattern)
+                for pattern in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(name, pattern)
+                       for pattern in self.exclude)
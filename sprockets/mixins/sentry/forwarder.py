@@ -0,0 +1,282 @@
+"""
+sprockets.mixins.sentry.forwarder
+
+Share a single Sentry delivery pipeline between forked worker processes.
+
+Start the forwarder before forking the workers and point each worker
+at its socket when installing the client::
+
+    forwarder.spawn('/var/run/myapp/sentry.sock')
+    tornado.process.fork_processes(0)
+    sentry.install(application, forwarder='/var/run/myapp/sentry.sock')
+
+The forwarder can also be run as a separate service with
+``python -m sprockets.mixins.sentry.forwarder PATH``.
+
+"""
+import argparse
+import asyncio
+import errno
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import time
+
+from tornado import gen, ioloop
+
+from sprockets.mixins.sentry import transport
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_MESSAGE_SIZE = 1024 * 1024
+"""Largest event that is sent through the forwarder socket."""
+
+_HEADER = struct.Struct('!I')  # metadata length
+
+
+def pack(url, headers, data):
+    """Encode an event for the forwarder socket."""
+    metadata = json.dumps({'url': url, 'headers': headers}).encode()
+    return _HEADER.pack(len(metadata)) + metadata + data
+
+
+def unpack(message):
+    """Decode a message packed by :func:`pack` into its parts."""
+    length, = _HEADER.unpack_from(message)
+    metadata = json.loads(message[_HEADER.size:_HEADER.size + length])
+    return metadata['url'], metadata['headers'], \
+        message[_HEADER.size + length:]
+
+
+class ForwardingTransport(transport.TornadoTransport):
+    """
+    Hand events to a :class:`Forwarder` over a Unix domain socket.
+
+    :param str forwarder_path: the socket that the forwarder listens on
+
+    Remaining parameters are passed to
+    :class:`~sprockets.mixins.sentry.transport.TornadoTransport`.  Events
+    are delivered directly, exactly as that transport does, whenever the
+    forwarder cannot accept them.
+
+    .. attribute:: forwarded
+
+       Number of events handed to the forwarder.
+
+    .. attribute:: fallbacks
+
+       Number of events that were delivered directly.
+
+    """
+
+    def __init__(self, *args, forwarder_path, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.forwarder_path = forwarder_path
+        self.forwarded = 0
+        self.fallbacks = 0
+        self._socket = None
+
+    async def _post(self, url, data, headers):
+        message = pack(url, headers, data)
+        if len(message) <= MAX_MESSAGE_SIZE:
+            try:
+                self._get_socket().send(message)
+            except OSError as error:
+                LOGGER.debug('forwarder is unavailable: %s', error)
+                self._close_socket()
+            else:
+                self.forwarded += 1
+                return
+        self.fallbacks += 1
+        await super()._post(url, data, headers)
+
+    def _get_socket(self):
+        if self._socket is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                sock.setblocking(False)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                MAX_MESSAGE_SIZE * 2)
+                sock.connect(self.forwarder_path)
+            except OSError:
+                sock.close()
+                raise
+            self._socket = sock
+        return self._socket
+
+    def _close_socket(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class Forwarder:
+    """
+    Receive events from worker processes and deliver them to Sentry.
+
+    :param str path: the socket to listen on.  An existing socket at the
+        same path is replaced.
+    :param float rate: events per second that are delivered on average
+    :param int burst: events that are delivered in a burst before `rate`
+        applies
+    :param transport_options: keyword parameters for the
+        :class:`~sprockets.mixins.sentry.transport.TornadoTransport`
+        that delivers the events
+
+    .. attribute:: received
+
+       Number of events that were received.
+
+    .. attribute:: rate_limited
+
+       Number of events discarded because of the rate limit.
+
+    """
+
+    def __init__(self, path, rate=100.0, burst=500, **transport_options):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.transport = transport.TornadoTransport(**transport_options)
+        self.received = 0
+        self.rate_limited = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._socket = None
+
+    def start(self):
+        """Listen for events on the current IOLoop."""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                MAX_MESSAGE_SIZE * 4)
+        self._socket.bind(self.path)
+        ioloop.IOLoop.current().add_handler(
+            self._socket.fileno(), self._on_readable, ioloop.IOLoop.READ)
+        LOGGER.info('forwarding sentry events received on %s', self.path)
+
+    async def stop(self, timeout=None):
+        """Stop listening and deliver the events that were received."""
+        if self._socket is not None:
+            ioloop.IOLoop.current().remove_handler(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        await self.transport.flush(timeout)
+
+    def _on_readable(self, fd, events):
+        while True:
+            try:
+                message = self._socket.recv(MAX_MESSAGE_SIZE + 1)
+            except OSError as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    LOGGER.error('failed to read from %s: %s', self.path,
+                                 error)
+                return
+            self.received += 1
+            if not self._admit():
+                self.rate_limited += 1
+                continue
+            try:
+                url, headers, data = unpack(message)
+            except (ValueError, KeyError, struct.error) as error:
+                LOGGER.warning('discarding malformed event: %s', error)
+                continue
+            self.transport.async_send(url, data, headers, _ignore,
+                                      self._on_failure)
+
+    def _admit(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._tokens = min(float(self.burst),
+                           self._tokens + elapsed * self.rate)
+        self._last_refill = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    @staticmethod
+    def _on_failure(error):
+        LOGGER.error('failed to deliver forwarded sentry event: %s', error)
+
+
+def _ignore():
+    pass
+
+
+def run(path, **options):
+    """
+    Run a :class:`Forwarder` on a new event loop until it is signalled.
+
+    :param str path: the socket to listen on
+    :param options: keyword parameters for :class:`Forwarder`
+
+    Queued events are delivered before returning when the process
+    receives ``SIGINT`` or ``SIGTERM``.
+
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    forwarder = Forwarder(path, **options)
+    loop.call_soon(forwarder.start)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    try:
+        loop.run_forever()
+        loop.run_until_complete(forwarder.stop(timeout=5.0))
+    except gen.TimeoutError:
+        LOGGER.warning('discarding %d undelivered sentry events',
+                       len(forwarder.transport.queue))
+    finally:
+        loop.close()
+
+
+def spawn(path, **options):
+    """
+    Run a :class:`Forwarder` in a separate daemon process.
+
+    :param str path: the socket to listen on
+    :param options: keyword parameters for :class:`Forwarder`
+    :rtype: multiprocessing.Process
+
+    Call this before forking worker processes.  The process exits with
+    the parent process.
+
+    """
+    process = multiprocessing.Process(target=run, args=(path, ),
+                                      kwargs=options, daemon=True,
+                                      name='sentry-forwarder')
+    process.start()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Forward Sentry events from worker processes')
+    parser.add_argument('path', help='socket to listen on')
+    parser.add_argument('--rate', type=float, default=100.0,
+                        help='events per second to deliver')
+    parser.add_argument('--burst', type=int, default=500,
+                        help='events to deliver in a burst')
+    parser.add_argument('--max-queue-size', type=int, default=1000,
+                        help='events to queue before dropping')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run(args.path, rate=args.rate, burst=args.burst,
+        max_queue_size=args.max_queue_size)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
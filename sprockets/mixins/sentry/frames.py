@@ -0,0 +1,299 @@
+"""
+sprockets.mixins.sentry.frames
+
+Build stack traces without rereading source files for every frame.
+
+raven reads the source of every module in a traceback each time an
+exception is captured, which is most of the cost of reporting from a
+deep coroutine stack.  The :class:`ExceptionEvent` in this module
+produces the same stack trace interface from a process-wide
+:class:`SourceCache` and optionally bounds the frame locals that are
+captured with :class:`FrameLimits`.
+
+"""
+import collections
+import linecache
+import logging
+import os
+import sys
+import threading
+
+from raven import events
+from raven.utils import stacks
+
+from sprockets.mixins.sentry import snapshot
+
+CONTEXT_LINES = 5
+"""Number of source lines that are reported around each line."""
+
+
+class SourceCache:
+    """
+    Process-wide cache of source lines and their context.
+
+    :param int max_files: maximum number of files to retain.  The least
+        recently used file is discarded once the cache is full.
+
+    Files are keyed by their name and modification time, so a module
+    that changes on disk is read again.  The context around each line is
+    computed once per file version.
+
+    .. attribute:: hits
+
+       Number of lookups that were answered from the cache.
+
+    .. attribute:: misses
+
+       Number of lookups that read a file.
+
+    """
+
+    def __init__(self, max_files=512):
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._files = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._files)
+
+    def clear(self):
+        """Discard every cached file."""
+        with self._lock:
+            self._files.clear()
+
+    def get_context(self, filename, lineno, loader=None, module_name=None,
+                    context_lines=CONTEXT_LINES):
+        """
+        Retrieve the source around a line.
+
+        :param str filename: the file that the code was loaded from
+        :param int lineno: zero-based line number
+        :param loader: the module's ``__loader__`` which is asked for the
+            source before the file is read
+        :param str module_name: the module's ``__name__``
+        :param int context_lines: number of lines before and after
+            `lineno` to return
+        :returns: ``(pre_context, context_line, post_context)`` like
+            :func:`raven.utils.stacks.get_lines_from_file`
+
+        """
+        try:
+            mtime = os.stat(filename).st_mtime
+        except (OSError, ValueError):
+            mtime = None
+        key = filename, mtime
+        with self._lock:
+            entry = self._files.get(key)
+            if entry is not None:
+                self._files.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            entry = (_read_source(filename, loader, module_name), {})
+            with self._lock:
+                self.misses += 1
+                self._files[key] = entry
+                if len(self._files) > self.max_files:
+                    self._files.popitem(last=False)
+        lines, contexts = entry
+        context = contexts.get((lineno, context_lines))
+        if context is None:
+            context = _slice(lines, lineno, context_lines)
+            contexts[lineno, context_lines] = context
+        pre_context, context_line, post_context = context
+        if pre_context is not None:  # callers may modify the lists
+            pre_context, post_context = list(pre_context), list(post_context)
+        return pre_context, context_line, post_context
+
+
+SOURCE_CACHE = SourceCache()
+"""The :class:`SourceCache` that :class:`ExceptionEvent` uses."""
+
+
+class FrameLimits:
+    """
+    Bound the frame locals that are captured for an exception.
+
+    :param int max_depth: number of frames, counted from the frame that
+        raised, whose locals are captured.  :data:`None` captures
+        locals for every frame.
+    :param int max_locals: maximum number of variables captured for
+        each frame
+    :param int max_repr_length: variables whose representation is longer
+        than this are replaced with a truncated representation
+
+    raven captures the locals of every frame, which is expensive for
+    the deep stacks of coroutines that are mostly framework code and
+    rarely helpful there.
+
+    """
+
+    def __init__(self, max_depth=10, max_locals=25, max_repr_length=256):
+        self.max_depth = max_depth
+        self.max_locals = max_locals
+        self.max_repr_length = max_repr_length
+
+    def get_locals(self, frame, transformer):
+        """
+        Capture the locals of `frame` within the limits.
+
+        :param frame: the frame object
+        :param transformer: callable that converts values into a form
+            that can be reported
+        :returns: a :class:`dict` of variables or :data:`None`
+
+        """
+        f_locals = getattr(frame, 'f_locals', None)
+        if not f_locals:
+            return None
+        try:
+            items = list(f_locals.items())
+        except Exception:
+            return None
+        if self.max_locals is not None:
+            items = items[:self.max_locals]
+        f_vars = {}
+        for name, value in items:
+            value = transformer(value)
+            if self.max_repr_length is not None:
+                text = value if isinstance(value, str) else repr(value)
+                if len(text) > self.max_repr_length:
+                    value = text[:self.max_repr_length - 3] + '...'
+            f_vars[name] = value
+        return f_vars
+
+
+class ExceptionEvent(events.Exception):
+    """
+    The :class:`raven.events.Exception` event, with cached source.
+
+    :class:`~sprockets.mixins.sentry.client.Client` uses this for every
+    exception that it captures.  Locals are bounded by the client's
+    ``frame_limits`` attribute when it is set.  An
+    :class:`~sprockets.mixins.sentry.snapshot.ExceptionSnapshot` can be
+    captured in place of an ``exc_info`` tuple.
+
+    """
+
+    def capture(self, exc_info=None, **kwargs):
+        if not isinstance(exc_info, snapshot.ExceptionSnapshot):
+            return super().capture(exc_info=exc_info, **kwargs)
+        values = []
+        for exc_type, message, frames in exc_info.chain:
+            value = super()._get_value(exc_type, message, None)
+            value['stacktrace'] = get_stack_info(
+                frames, transformer=self.transform,
+                capture_locals=self.client.capture_locals)
+            values.insert(0, value)
+        return {'level': kwargs.get('level', logging.ERROR),
+                self.name: {'values': values}}
+
+    def _get_value(self, exc_type, exc_value, exc_traceback):
+        value = super()._get_value(exc_type, exc_value, None)
+        value['stacktrace'] = get_stack_info(
+            stacks.iter_traceback_frames(exc_traceback),
+            transformer=self.transform,
+            capture_locals=self.client.capture_locals,
+            limits=getattr(self.client, 'frame_limits', None))
+        return value
+
+
+def get_stack_info(frames, transformer, capture_locals=True, limits=None,
+                   source_cache=None, frame_allowance=25):
+    """
+    Build the stack trace interface for `frames`.
+
+    :param frames: iterable of ``(frame, lineno)`` pairs from the
+        outermost frame to the innermost
+    :param transformer: callable that converts locals into a form that
+        can be reported
+    :param bool capture_locals: should frame locals be reported?
+    :param FrameLimits limits: optional bounds for the locals
+    :param SourceCache source_cache: defaults to :data:`SOURCE_CACHE`
+    :param int frame_allowance: passed to
+        :func:`raven.utils.stacks.slim_frame_data`
+    :returns: the same structure as
+        :func:`raven.utils.stacks.get_stack_info`
+
+    """
+    if source_cache is None:
+        source_cache = SOURCE_CACHE
+    frames = [(frame, lineno) for frame, lineno in frames]
+    first_with_locals = 0
+    if limits is not None and limits.max_depth is not None:
+        first_with_locals = len(frames) - limits.max_depth
+    result = []
+    for index, (frame, lineno) in enumerate(frames):
+        f_globals = getattr(frame, 'f_globals', {})
+        f_code = getattr(frame, 'f_code', None)
+        abs_path = f_code.co_filename if f_code else None
+        function = f_code.co_name if f_code else None
+        module_name = f_globals.get('__name__')
+        if lineno:
+            lineno -= 1
+        if lineno is not None and abs_path:
+            pre_context, context_line, post_context = \
+                source_cache.get_context(abs_path, lineno,
+                                         f_globals.get('__loader__'),
+                                         module_name)
+        else:
+            pre_context = context_line = post_context = None
+
+        frame_result = {'abs_path': abs_path,
+                        'filename': _relative_path(abs_path, module_name),
+                        'module': module_name or None,
+                        'function': function or '<unknown>',
+                        'lineno': lineno + 1}
+        if capture_locals and index >= first_with_locals:
+            if limits is None:
+                f_vars = stacks.get_frame_locals(frame,
+                                                 transformer=transformer)
+            else:
+                f_vars = limits.get_locals(frame, transformer)
+            if f_vars:
+                frame_result['vars'] = f_vars
+        if context_line is not None:
+            frame_result.update({'pre_context': pre_context,
+                                 'context_line': context_line,
+                                 'post_context': post_context})
+        result.append(frame_result)
+    return {'frames': stacks.slim_frame_data(
+        result, frame_allowance=frame_allowance)}
+
+
+def _read_source(filename, loader, module_name):
+    source = None
+    if loader is not None and hasattr(loader, 'get_source'):
+        try:
+            source = loader.get_source(module_name)
+        except (ImportError, IOError):
+            source = None
+    if source is not None:
+        return source.splitlines()
+    try:
+        linecache.checkcache(filename)
+        return [line.rstrip('\r\n') for line in linecache.getlines(filename)]
+    except (OSError, IOError):
+        return []
+
+
+def _slice(lines, lineno, context_lines):
+    if not lines or not 0 <= lineno < len(lines):
+        return None, None, None
+    lower_bound = max(0, lineno - context_lines)
+    upper_bound = min(lineno + 1 + context_lines, len(lines))
+    return (stacks.slim_string(lines[lower_bound:lineno]),
+            stacks.slim_string(lines[lineno]),
+            stacks.slim_string(lines[lineno + 1:upper_bound]))
+
+
+def _relative_path(abs_path, module_name):
+    # /foo/site-packages/baz/bar.py becomes baz/bar.py, like raven
+    try:
+        base_filename = sys.modules[module_name.split('.', 1)[0]].__file__
+        filename = abs_path.split(
+            base_filename.rsplit(os.sep, 2)[0], 1)[-1].lstrip(os.sep)
+    except Exception:
+        filename = abs_path
+    return filename or abs_path
@@ -0,0 +1,115 @@
+"""
+sprockets.mixins.sentry.httperrors
+
+Report elevated HTTP error rates without reporting every error.
+
+"""
+import logging
+
+from tornado import ioloop
+
+LOGGER = logging.getLogger(__name__)
+
+OTHER = '<other>'
+"""Name that requests are counted under once the table is full."""
+
+
+class HTTPErrorAggregator:
+    """
+    Count error responses per handler and report them once per window.
+
+    :param client: the :class:`raven.base.Client` that summary events
+        are sent with
+    :param float window: seconds that counts are aggregated for
+    :param statuses: status codes that are counted as errors.  The
+        default is every 5xx status.
+    :param int min_count: errors that a handler must return within a
+        window to be reported
+    :param float min_ratio: fraction of a handler's responses within a
+        window that must be errors for it to be reported
+    :param int max_handlers: maximum number of handler classes that are
+        counted separately.  Further handlers are counted as
+        :data:`OTHER`.
+
+    :class:`~sprockets.mixins.sentry.SentryMixin` records the status of
+    every response, whether it was set directly, raised as a
+    :exc:`tornado.web.HTTPError`, or the result of an unhandled
+    exception.  Recording is a couple of dictionary updates.  A window
+    starts with the first response after the previous window ended.  At
+    the end of each window, a single event lists the handlers that
+    crossed both thresholds, and the counts are reset.
+
+    .. attribute:: summaries
+
+       Number of summary events that were sent.
+
+    """
+
+    def __init__(self, client, window=60.0, statuses=range(500, 600),
+                 min_count=10, min_ratio=0.0, max_handlers=1000):
+        self.client = client
+        self.window = window
+        self.statuses = frozenset(statuses)
+        self.min_count = min_count
+        self.min_ratio = min_ratio
+        self.max_handlers = max_handlers
+        self.summaries = 0
+        self._requests = {}
+        self._errors = {}
+        self._scheduled = False
+
+    def record(self, handler_name, status):
+        """Count a response from `handler_name`."""
+        requests = self._requests
+        if handler_name not in requests:
+            if len(requests) >= self.max_handlers:
+                handler_name = OTHER
+            requests.setdefault(handler_name, 0)
+        requests[handler_name] += 1
+        if status in self.statuses:
+            key = handler_name, status
+            self._errors[key] = self._errors.get(key, 0) + 1
+        if not self._scheduled:
+            self._scheduled = True
+            ioloop.IOLoop.current().call_later(self.window,
+                                               self.send_summary)
+
+    def drain(self):
+        """
+        Retrieve and reset the counts of handlers over the thresholds.
+
+        :returns: a :class:`dict` of handler names to their request
+            count, error count, and error counts by status
+        :rtype: dict
+
+        """
+        requests, errors = self._requests, self._errors
+        self._requests, self._errors = {}, {}
+        handlers = {}
+        for (handler_name, status), count in errors.items():
+            entry = handlers.setdefault(
+                handler_name, {'requests': requests[handler_name],
+                               'errors': 0, 'statuses': {}})
+            entry['errors'] += count
+            entry['statuses'][status] = count
+        return {handler_name: entry
+                for handler_name, entry in handlers.items()
+                if entry['errors'] >= self.min_count and
+                entry['errors'] / entry['requests'] >= self.min_ratio}
+
+    def send_summary(self):
+        """Send a single event that describes the elevated error rates."""
+        self._scheduled = False
+        handlers = self.drain()
+        if not handlers:
+            return
+        LOGGER.debug('reporting elevated error rates for %d handlers',
+                     len(handlers))
+        self.summaries += 1
+        self.client.captureMessage(
+            'Elevated HTTP error rates from {0}'.format(
+                ', '.join(sorted(handlers))),
+            level=logging.WARNING,
+            extra={'handlers': handlers, 'window_seconds': self.window},
+            data={'logger': 'sprockets.mixins.sentry',
+                  'fingerprint': ['http-error-rates']})
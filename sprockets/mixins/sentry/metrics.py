@@ -0,0 +1,184 @@
+"""
+sprockets.mixins.sentry.metrics
+
+Measure what error reporting costs.
+
+Pass an implementation of :class:`Metrics` as the ``metrics`` parameter
+of :func:`sprockets.mixins.sentry.install` to record the following:
+
+- ``handle_seconds`` histogram of the time spent reporting in
+  :meth:`~sprockets.mixins.sentry.SentryMixin._handle_request_exception`
+- ``build_seconds`` histogram of the time spent building event payloads
+- ``event_bytes`` histogram of serialized and compressed event sizes
+- ``delivery_seconds`` histogram of the time from posting an event to
+  Sentry until it is delivered.  Time spent waiting in the
+  :class:`~sprockets.mixins.sentry.transport.TornadoTransport` queue is
+  not included.
+- ``queue_depth`` gauge of the events waiting in the
+  :class:`~sprockets.mixins.sentry.transport.TornadoTransport` queue
+- ``sent`` count of events delivered to Sentry
+- ``failed`` count of events that failed to deliver
+- ``dropped`` count of events discarded because the queue was full
+- ``sampled_out`` count of exceptions discarded by sampling
+- ``rate_limited`` count of exceptions suppressed by rate limiting
+- ``short_circuited`` count of exceptions discarded by the circuit breaker
+- ``worker_pending`` gauge of the events waiting for the
+  :class:`~sprockets.mixins.sentry.workers.WorkerPool`
+- ``worker_dropped`` count of events discarded because the worker pool
+  was saturated
+
+Nothing is measured when no implementation is installed.
+
+"""
+import bisect
+import threading
+
+HANDLE_SECONDS = 'handle_seconds'
+BUILD_SECONDS = 'build_seconds'
+EVENT_BYTES = 'event_bytes'
+DELIVERY_SECONDS = 'delivery_seconds'
+QUEUE_DEPTH = 'queue_depth'
+SENT = 'sent'
+FAILED = 'failed'
+DROPPED = 'dropped'
+SAMPLED_OUT = 'sampled_out'
+RATE_LIMITED = 'rate_limited'
+SHORT_CIRCUITED = 'short_circuited'
+WORKER_PENDING = 'worker_pending'
+WORKER_DROPPED = 'worker_dropped'
+
+DURATIONS = frozenset([HANDLE_SECONDS, BUILD_SECONDS, DELIVERY_SECONDS])
+"""Histograms that are measured in seconds."""
+
+
+class Metrics:
+    """
+    Interface for recording metrics.  Every method is a no-op.
+
+    Implementations may be called from threads other than the IOLoop's
+    when raven's threaded transport is in use.
+
+    """
+
+    def increment(self, name, value=1):
+        """Add `value` to the counter `name`."""
+
+    def observe(self, name, value):
+        """Record `value` in the histogram `name`."""
+
+    def gauge(self, name, value):
+        """Set the gauge `name` to `value`."""
+
+
+class StatsdMetrics(Metrics):
+    """
+    Send metrics to a statsd client.
+
+    :param statsd: an object with ``incr``, ``timing``, and ``gauge``
+        methods, such as :class:`statsd.StatsClient`.
+    :param str prefix: prepended to every metric name
+
+    Durations are converted to milliseconds and sent as timers, which
+    statsd aggregates into percentiles.  Event sizes are sent as timers
+    too, since statsd has no other histogram type.
+
+    """
+
+    def __init__(self, statsd, prefix='sentry.'):
+        self.statsd = statsd
+        self.prefix = prefix
+
+    def increment(self, name, value=1):
+        self.statsd.incr(self.prefix + name, value)
+
+    def observe(self, name, value):
+        if name in DURATIONS:
+            value *= 1000.0
+        self.statsd.timing(self.prefix + name, value)
+
+    def gauge(self, name, value):
+        self.statsd.gauge(self.prefix + name, value)
+
+
+class Histogram:
+    """
+    Cumulative bucket counts in the style of a Prometheus histogram.
+
+    :param buckets: ascending upper bounds of the buckets.  An implicit
+        ``+Inf`` bucket counts every observation.
+
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return ``(upper bound, count)`` pairs that include ``+Inf``."""
+        pairs, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'), ),
+                                self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class InMemoryMetrics(Metrics):
+    """
+    Keep metrics in memory so that they can be scraped.
+
+    :param dict buckets: optional mapping of histogram name to bucket
+        bounds that overrides :attr:`default_buckets`
+
+    Expose :meth:`snapshot` from a handler or feed it to a Prometheus
+    collector.
+
+    """
+
+    default_buckets = {
+        HANDLE_SECONDS: (.0005, .001, .0025, .005, .01, .025, .05, .1),
+        BUILD_SECONDS: (.0005, .001, .0025, .005, .01, .025, .05, .1),
+        DELIVERY_SECONDS: (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+        EVENT_BYTES: (1024, 4096, 16384, 65536, 262144, 1048576),
+    }
+
+    def __init__(self, buckets=None):
+        self.buckets = dict(self.default_buckets, **(buckets or {}))
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            try:
+                histogram = self.histograms[name]
+            except KeyError:
+                histogram = self.histograms[name] = Histogram(
+                    self.buckets.get(name, ()))
+            histogram.observe(value)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        """Return the current values as a :class:`dict`."""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'histograms': {
+                    name: {'count': histogram.count, 'sum': histogram.sum,
+                           'buckets': histogram.cumulative()}
+                    for name, histogram in self.histograms.items()}}
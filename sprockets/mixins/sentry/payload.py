@@ -0,0 +1,151 @@
+"""
+sprockets.mixins.sentry.payload
+
+Keep the request portion of Sentry payloads within a size budget.
+
+"""
+
+BODY_FULL = 'full'
+"""Report the request body as-is."""
+
+BODY_OFF = 'off'
+"""Never report the request body."""
+
+BODY_TRUNCATE = 'truncate'
+"""Report the head and tail of the request body."""
+
+BODY_TEXT = 'text'
+"""Report the head and tail of textual request bodies only."""
+
+BODY_MODES = frozenset([BODY_FULL, BODY_OFF, BODY_TRUNCATE, BODY_TEXT])
+
+TRUNCATION_MARKER = b'\n...\n'
+
+_TEXT_TYPES = ('application/json', 'application/x-www-form-urlencoded')
+
+
+def is_text(content_type):
+    """
+    Is `content_type` something that is worth reporting?
+
+    :param str content_type: value of the ``Content-Type`` header
+    :rtype: bool
+
+    """
+    if not content_type:
+        return False
+    media_type = content_type.partition(';')[0].strip().lower()
+    return (media_type.startswith('text/') or media_type in _TEXT_TYPES
+            or media_type.endswith('+json'))
+
+
+def window(body, limit):
+    """
+    Return the first and last bytes of `body`.
+
+    :param bytes body: the request body
+    :param int limit: the maximum number of bytes to keep
+    :rtype: bytes
+
+    Only the retained window is copied out of `body`.
+
+    """
+    if limit is None or len(body) <= limit:
+        return body
+    view = memoryview(body)
+    head = limit - limit // 2
+    tail = limit // 2
+    return b''.join((view[:head], TRUNCATION_MARKER,
+                     view[len(view) - tail:]))
+
+
+def capture_body(body, content_type, mode=BODY_FULL, limit=None):
+    """
+    Select the portion of `body` to report.
+
+    :param bytes body: the request body
+    :param str content_type: value of the ``Content-Type`` header
+    :param str mode: one of :data:`BODY_MODES`
+    :param int limit: maximum number of bytes to report for the
+        :data:`BODY_TRUNCATE` and :data:`BODY_TEXT` modes
+    :rtype: bytes
+
+    """
+    if mode == BODY_FULL or not body:
+        return body
+    if mode == BODY_OFF:
+        return b''
+    if mode == BODY_TEXT and not is_text(content_type):
+        return '<{0} bytes of {1}>'.format(len(body), content_type
+                                           or 'unknown content').encode()
+    return window(body, limit)
+
+
+def estimate_size(value):
+    """
+    Cheaply approximate the encoded size of `value` in bytes.
+
+    This walks containers without serializing anything, so it is an
+    estimate and not the exact size of the JSON document.
+
+    """
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(key)) + estimate_size(item)
+                   for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(item) for item in value)
+    return 8
+
+
+def trim(request, extra, budget):
+    """
+    Trim the largest fields until the payload fits in `budget` bytes.
+
+    :param dict request: the ``request`` interface.  The ``data`` and
+        ``headers`` values are replaced when they are trimmed.
+    :param dict extra: the extra values.  This is not modified.
+    :param int budget: the approximate number of bytes to allow
+    :returns: `extra` or a trimmed copy of it
+    :rtype: dict
+
+    The body is trimmed to whatever is left of the budget, while the
+    largest values in the headers and extra data are replaced by a short
+    note that records their size.
+
+    """
+    sizes = {'body': estimate_size(request.get('data') or b''),
+             'headers': estimate_size(request.get('headers') or {}),
+             'extra': estimate_size(extra)}
+    excess = sum(sizes.values()) - budget
+    for field in sorted(sizes, key=sizes.get, reverse=True):
+        if excess <= 0:
+            break
+        if field == 'body':
+            keep = max(sizes['body'] - excess - len(TRUNCATION_MARKER), 0)
+            request['data'] = window(request['data'], keep)
+            excess -= sizes['body'] - len(request['data'])
+        elif field == 'headers':
+            request['headers'], excess = _trim_mapping(
+                request['headers'], excess)
+        else:
+            extra, excess = _trim_mapping(extra, excess)
+    return extra
+
+
+def _trim_mapping(mapping, excess):
+    trimmed = None
+    sizes = {key: estimate_size(value) for key, value in mapping.items()}
+    for key in sorted(sizes, key=sizes.get, reverse=True):
+        if excess <= 0:
+            break
+        size = sizes[key]
+        note = '<trimmed {0} bytes>'.format(size)
+        if len(note) >= size:
+            continue
+        if trimmed is None:
+            trimmed = dict(mapping)
+        trimmed[key] = note
+        excess -= size - len(note)
+    return mapping if trimmed is None else trimmed, excess
@@ -0,0 +1,141 @@
+"""
+sprockets.mixins.sentry.processors
+
+raven processors that sanitize events.
+
+"""
+import re
+
+from raven.processors import SanitizePasswordsProcessor
+
+
+class SanitizeEmailsProcessor(SanitizePasswordsProcessor):
+    """
+    Remove all email addresses from the payload sent to sentry.
+
+    """
+
+    FIELDS = frozenset(['email', 'email_address'])
+    VALUES_RE = re.compile(r"""
+    ((?:[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*|"
+      (?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]|
+       \\[\x01-\x09\x0b\x0c\x0e-\x7f])*\")
+      @
+      (?:(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9]
+      (?:[a-z0-9-]*[a-z0-9])?|\[(?:(?:25[0-5]|2[0-4][0-9]|
+       [01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?|
+       [a-z0-9-]*[a-z0-9]:(?:[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x5a\x53-\x7f]|
+       \\[\x01-\x09\x0b\x0c\x0e-\x7f])+)\]))
+    """, re.VERBOSE ^ re.IGNORECASE)  # RFC5322
+
+    def sanitize(self, key, value):
+        if value is None:
+            return
+
+        if isinstance(value, str):
+            if '@' not in value:  # cannot match VALUES_RE
+                return value
+            return self.VALUES_RE.sub(self.MASK, value)
+
+        if not key:  # key can be a NoneType
+            return value
+
+        # Just in case we have bytes here, we want to make them into text
+        # properly without failing so we can perform our check.
+        if isinstance(key, bytes):
+            key = key.decode('utf-8', 'replace')
+        else:
+            key = str(key)
+
+        key = key.lower()
+        for field in self.FIELDS:
+            if field in key:
+                # store mask as a fixed length for security
+                return self.MASK
+        return value
+
+
+class SanitizePasswordsAndEmailsProcessor(SanitizeEmailsProcessor):
+    """
+    Remove passwords and email addresses in a single pass.
+
+    This produces the same output as running raven's
+    :class:`~raven.processors.SanitizePasswordsProcessor` followed by
+    :class:`.SanitizeEmailsProcessor` while only walking the payload
+    once.  Use it in place of the pair in the ``processors`` list that
+    is passed to :func:`.install`.
+
+    The decision for each key name is cached since the same names
+    appear in nearly every event, and the value regular expressions
+    are only run against strings that could possibly match them.
+
+    """
+
+    PASSWORD_KEYS = SanitizePasswordsProcessor.KEYS
+    CARD_RE = SanitizePasswordsProcessor.VALUES_RE
+    MAX_CACHED_KEYS = 4096
+
+    _key_cache = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._key_cache = {}  # subclasses may classify keys differently
+
+    def _mask_for_key(self, key):
+        """Returns a tuple of (is password key, is email key)."""
+        try:
+            return self._key_cache[key]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable keys are not cached
+            return self._classify_key(key)
+        if len(self._key_cache) >= self.MAX_CACHED_KEYS:
+            self._key_cache.clear()
+        result = self._classify_key(key)
+        self._key_cache[key] = result
+        return result
+
+    def _classify_key(self, key):
+        if isinstance(key, bytes):
+            name = key.decode('utf-8', 'replace').lower()
+        else:
+            name = str(key).lower()
+        return (any(field in name for field in self.PASSWORD_KEYS),
+                any(field in name for field in self.FIELDS))
+
+    def sanitize(self, key, value):
+        if value is None:
+            return
+
+        masks = self._mask_for_key(key) if key else (False, False)
+        if masks[0]:
+            return self.MASK
+
+        if isinstance(value, str):
+            # card numbers must start with a digit and emails need an @
+            if value[:1].isdigit() and self.CARD_RE.match(value):
+                return self.MASK
+            if '@' in value:
+                return self.VALUES_RE.sub(self.MASK, value)
+            return value
+
+        if masks[1]:
+            return self.MASK
+        return value
+
+    def filter_http(self, data):
+        cookie = None
+        headers = data.get('headers')
+        if isinstance(headers, dict) and 'Cookie' in headers:
+            cookie = headers['Cookie']
+        super().filter_http(data)
+        if cookie is not None:
+            # The individual processors sanitize the cookie header as a
+            # whole before sanitizing it as key/value pairs, so apply the
+            # steps in the same order here.
+            passwords = SanitizePasswordsProcessor(self.client)
+            emails = SanitizeEmailsProcessor(self.client)
+            cookie = passwords._sanitize_keyvals(
+                passwords.sanitize('Cookie', cookie), ';')
+            data['headers']['Cookie'] = emails._sanitize_keyvals(
+                emails.sanitize('Cookie', cookie), ';')
@@ -0,0 +1,183 @@
+"""
+sprockets.mixins.sentry.ratelimit
+
+Per-fingerprint deduplication of captured exceptions.
+
+"""
+import collections
+import logging
+import time
+
+from tornado import ioloop
+
+LOGGER = logging.getLogger(__name__)
+
+
+def fingerprint(exc_info, handler_name, include_paths=(), exclude_paths=()):
+    """
+    Cheaply identify an exception without building a Sentry payload.
+
+    :param tuple exc_info: the exception as returned by
+        :func:`sys.exc_info`
+    :param str handler_name: name of the request handler class
+    :param include_paths: module prefixes that are part of the application
+    :param exclude_paths: module prefixes that are never part of the
+        application
+    :returns: a hashable tuple of the exception type, the innermost
+        in-app frame, and `handler_name`
+    :rtype: tuple
+
+    The innermost frame that is :func:`in_app` is used.  The innermost
+    frame is used if none of the frames are in the application.
+
+    """
+    exc_type, _, tb = exc_info
+    location = innermost = None
+    while tb is not None:
+        frame = tb.tb_frame
+        module = frame.f_globals.get('__name__') or ''
+        innermost = (module, frame.f_code.co_name, tb.tb_lineno)
+        if in_app(module, include_paths, exclude_paths):
+            location = innermost
+        tb = tb.tb_next
+    return (exc_type.__module__ + '.' + exc_type.__qualname__,
+            location or innermost, handler_name)
+
+
+def in_app(module, include_paths, exclude_paths):
+    """
+    Is `module` part of the application?
+
+    :param str module: the dotted name of the module
+    :param include_paths: module prefixes that are part of the application
+    :param exclude_paths: module prefixes that are never part of the
+        application
+    :rtype: bool
+
+    A prefix matches the module that it names and the modules within it.
+
+    """
+    def matches(paths):
+        return any(module == path or module.startswith(path + '.')
+                   for path in paths)
+    return matches(include_paths or ()) and \
+        not matches(exclude_paths or ())
+
+
+def describe(key):
+    """Render a :func:`fingerprint` as a human readable string."""
+    exc_name, location, handler_name = key
+    if location is None:
+        return '{0} in {1}'.format(exc_name, handler_name)
+    return '{0} at {1}.{2}:{3} in {4}'.format(exc_name, *location,
+                                              handler_name)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiting keyed by exception fingerprint.
+
+    :param client: the :class:`raven.base.Client` that summary events
+        are sent with
+    :param float rate: tokens added to each bucket per second
+    :param int burst: maximum number of tokens in a bucket
+    :param int max_fingerprints: maximum number of buckets to retain.
+        The least recently used bucket is evicted when this is exceeded.
+    :param float summary_interval: seconds to wait after the first
+        suppressed event before sending the summary event.  Set this
+        to :data:`None` to only count suppressed events.
+
+    Each fingerprint starts with a full bucket of `burst` tokens and
+    every admitted event consumes a token.  Events that find an empty
+    bucket are counted instead of captured.  The counts are sent as a
+    single summary message `summary_interval` seconds after the first
+    event was suppressed.
+
+    .. attribute:: suppressed
+
+       Total number of events suppressed since the limiter was created.
+
+    """
+
+    def __init__(self, client, rate=1.0, burst=10, max_fingerprints=1000,
+                 summary_interval=60.0):
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.max_fingerprints = max_fingerprints
+        self.summary_interval = summary_interval
+        self.suppressed = 0
+        self._buckets = collections.OrderedDict()
+        self._evicted_suppressed = 0
+        self._summary_pending = False
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def admit(self, key):
+        """
+        Should an event with fingerprint `key` be captured?
+
+        :param key: a hashable fingerprint such as one returned
+            from :func:`fingerprint`
+        :rtype: bool
+
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now, 0]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_fingerprints:
+                _, evicted = self._buckets.popitem(last=False)
+                self._evicted_suppressed += evicted[2]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(self.burst),
+                            bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True
+
+        bucket[2] += 1
+        self.suppressed += 1
+        if not self._summary_pending and self.summary_interval is not None:
+            self._summary_pending = True
+            ioloop.IOLoop.current().call_later(self.summary_interval,
+                                               self.send_summary)
+        return False
+
+    def drain(self):
+        """
+        Retrieve and reset the suppressed counts.
+
+        :returns: a :class:`dict` of fingerprint descriptions to the
+            number of events that were suppressed
+        :rtype: dict
+
+        """
+        counts = {}
+        for key, bucket in self._buckets.items():
+            if bucket[2]:
+                counts[describe(key)] = bucket[2]
+                bucket[2] = 0
+        if self._evicted_suppressed:
+            counts['<evicted>'] = self._evicted_suppressed
+            self._evicted_suppressed = 0
+        return counts
+
+    def send_summary(self):
+        """Send a single event that describes the suppressed events."""
+        self._summary_pending = False
+        counts = self.drain()
+        if not counts:
+            return
+        total = sum(counts.values())
+        LOGGER.debug('suppressed %d duplicate sentry events', total)
+        self.client.captureMessage(
+            'Suppressed {0} duplicate exceptions'.format(total),
+            level=logging.WARNING,
+            extra={'suppressed': counts, 'suppressed_total': total},
+            data={'logger': 'sprockets.mixins.sentry'})
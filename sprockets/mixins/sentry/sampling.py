@@ -0,0 +1,107 @@
+"""
+sprockets.mixins.sentry.sampling
+
+Declarative sampling of captured exceptions.
+
+"""
+import collections
+import random
+import re
+import time
+
+
+class SamplingPolicy:
+    """
+    Decide which exceptions are reported before building a payload.
+
+    :param float rate: the default sample rate between 0 and 1
+    :param routes: optional mapping of regular expressions to sample
+        rates.  The first expression that matches the request path
+        selects the rate.
+    :param exceptions: optional mapping of exception classes to sample
+        rates.  The entry for the closest class in the exception's MRO
+        selects the rate.
+    :param int guaranteed_per_minute: number of exceptions per handler
+        and exception type that are reported every minute regardless of
+        the sample rate.
+    :param int max_keys: maximum number of handler and exception type
+        pairs tracked for `guaranteed_per_minute`.
+
+    The rate for an exception is chosen from the first of the following
+    that applies: a matching `exceptions` entry, the handler's
+    :attr:`~sprockets.mixins.sentry.SentryMixin.sentry_sample_rate`
+    attribute, a matching `routes` entry, and finally `rate`.
+
+    .. attribute:: sampled_out
+
+       Number of exceptions that were not reported.
+
+    """
+
+    def __init__(self, rate=1.0, routes=None, exceptions=None,
+                 guaranteed_per_minute=0, max_keys=1000):
+        self.rate = rate
+        self.routes = [(re.compile(pattern), route_rate)
+                       for pattern, route_rate in (routes or {}).items()]
+        self.exceptions = dict(exceptions or {})
+        self.guaranteed_per_minute = guaranteed_per_minute
+        self.max_keys = max_keys
+        self.sampled_out = 0
+        self._windows = collections.OrderedDict()
+        self._random = random.Random()
+
+    def get_rate(self, path, exc_type, handler_rate=None):
+        """
+        Determine the sample rate for an exception.
+
+        :param str path: the request path
+        :param type exc_type: the class of the exception
+        :param float handler_rate: rate set on the request handler
+        :rtype: float
+
+        """
+        if self.exceptions:
+            for cls in exc_type.__mro__:
+                if cls in self.exceptions:
+                    return self.exceptions[cls]
+        if handler_rate is not None:
+            return handler_rate
+        for pattern, route_rate in self.routes:
+            if pattern.search(path):
+                return route_rate
+        return self.rate
+
+    def should_sample(self, handler_name, path, exc_type, handler_rate=None):
+        """
+        Should this exception be reported?
+
+        :param str handler_name: name of the request handler class
+        :param str path: the request path
+        :param type exc_type: the class of the exception
+        :param float handler_rate: rate set on the request handler
+        :rtype: bool
+
+        """
+        if self.guaranteed_per_minute and self._within_guarantee(
+                (handler_name, exc_type)):
+            return True
+        rate = self.get_rate(path, exc_type, handler_rate)
+        if rate >= 1.0 or self._random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+    def _within_guarantee(self, key):
+        minute = int(time.monotonic() // 60)
+        window = self._windows.get(key)
+        if window is None:
+            window = [minute, 0]
+            self._windows[key] = window
+            if len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+            if window[0] != minute:
+                window[0], window[1] = minute, 0
+        window[1] += 1
+        return window[1] <= self.guaranteed_per_minute
@@ -0,0 +1,194 @@
+"""
+sprockets.mixins.sentry.serializer
+
+Strategies for turning events into request bodies.
+
+"""
+import collections.abc
+import datetime
+import json
+import uuid
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover -- orjson is optional
+    orjson = None
+
+_NATIVE_TYPES = (str, int, float, bool, type(None))
+
+
+def normalize(value):
+    """
+    Replace values that JSON cannot represent.
+
+    :param value: the event or a value within it
+    :returns: `value` or its replacement
+
+    Dictionaries and lists are updated in place, so only the values
+    that need replacing are copied.  Tuples that contain replaced values
+    become lists.  :class:`bytes` are decoded as UTF-8, sets become lists,
+    and other unknown values are replaced with their :func:`repr`, in
+    the same way as :class:`raven.utils.json.BetterJSONEncoder`.
+
+    """
+    if isinstance(value, _NATIVE_TYPES):
+        return value
+    if isinstance(value, dict):
+        for key, item in value.items():
+            replacement = normalize(item)
+            if replacement is not item:
+                value[key] = replacement
+        return value
+    if isinstance(value, list):
+        for index, item in enumerate(value):
+            replacement = normalize(item)
+            if replacement is not item:
+                value[index] = replacement
+        return value
+    if isinstance(value, tuple):
+        if hasattr(value, '_asdict'):  # namedtuple
+            return normalize(dict(value._asdict()))
+        items = [normalize(item) for item in value]
+        if any(new is not old for new, old in zip(items, value)):
+            return items
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode('utf-8', errors='replace')
+    if isinstance(value, (set, frozenset)):
+        return [normalize(item) for item in value]
+    if isinstance(value, uuid.UUID):
+        return value.hex
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    if isinstance(value, collections.abc.Mapping):
+        return normalize(dict(value))
+    try:
+        return repr(value)
+    except Exception:
+        return object.__repr__(value)
+
+
+class JSONSerializer:
+    """Serialize with the standard library :mod:`json` module."""
+
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(',', ':'),
+                                         default=repr)
+
+    def dumps(self, data):
+        """Serialize a normalized event to :class:`bytes`."""
+        return self._encoder.encode(data).encode('utf-8')
+
+
+class OrjsonSerializer:
+    """
+    Serialize with :mod:`orjson`, which is considerably faster.
+
+    :raises RuntimeError: if :mod:`orjson` is not installed
+
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError('orjson is not installed')
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, data):
+        """Serialize a normalized event to :class:`bytes`."""
+        return orjson.dumps(data, default=repr, option=self._options)
+
+
+SERIALIZERS = {JSONSerializer.name: JSONSerializer,
+               OrjsonSerializer.name: OrjsonSerializer}
+
+
+def get_serializer(serializer='json'):
+    """
+    Select a serializer.
+
+    :param serializer: a serializer instance, one of the names in
+        :data:`SERIALIZERS`, or ``'auto'`` for the fastest serializer
+        that is installed
+
+    """
+    if not isinstance(serializer, str):
+        return serializer
+    if serializer == 'auto':
+        serializer = 'orjson' if orjson is not None else 'json'
+    try:
+        return SERIALIZERS[serializer]()
+    except KeyError:
+        raise ValueError('unknown serializer {0!r}'.format(serializer))
+
+
+class Encoder:
+    """
+    Normalize, serialize, and optionally compress events.
+
+    :param serializer: passed to :func:`get_serializer`
+    :param int compress_level: :mod:`zlib` compression level from 0 to 9.
+        ``-1`` selects the :mod:`zlib` default.
+    :param int compress_threshold: serialized events smaller than this
+        many bytes are sent uncompressed
+
+    """
+
+    def __init__(self, serializer='json', compress_level=-1,
+                 compress_threshold=0):
+        self.serializer = get_serializer(serializer)
+        self.compress_level = compress_level
+        self.compress_threshold = compress_threshold
+
+    def encode(self, data, skeleton=None):
+        """
+        Return the request body for the event `data`.
+
+        :param dict data: the event
+        :param skeleton: optional
+            :class:`~sprockets.mixins.sentry.skeleton.EventSkeleton` whose
+            pre-serialized fields are spliced into the body instead of
+            serializing them again
+
+        """
+        fragment = None
+        if skeleton is not None:
+            data, split = skeleton.split(data)
+            if split:
+                fragment = skeleton.fragment(self.serializer)
+        body = self.serializer.dumps(normalize(data))
+        if fragment:
+            body = splice(body, fragment)
+        if len(body) < self.compress_threshold:
+            return body
+        return zlib.compress(body, self.compress_level)
+
+
+def splice(body, fragment):
+    """
+    Insert serialized members into a serialized JSON object.
+
+    :param bytes body: a serialized JSON object
+    :param bytes fragment: serialized members without enclosing braces
+    :rtype: bytes
+
+    """
+    body = body.lstrip()
+    if body[1:].lstrip().startswith(b'}'):
+        return b'{' + fragment + b'}'
+    return b'{' + fragment + b',' + body[1:]
+
+
+def is_compressed(body):
+    """
+    Was `body` compressed by :class:`Encoder`?
+
+    Serialized events are JSON objects, so they always start with ``{``
+    while :mod:`zlib` streams never do.
+
+    """
+    return body[:1] != b'{'
@@ -0,0 +1,104 @@
+"""
+sprockets.mixins.sentry.skeleton
+
+The parts of an event that do not change while a process runs.
+
+"""
+import types
+
+from raven import base
+
+from sprockets.mixins.sentry import serializer as serializer_module
+
+
+class EventSkeleton:
+    """
+    Frozen event fields that are shared by every event from a client.
+
+    :param client: the :class:`~sprockets.mixins.sentry.client.Client`
+
+    The server name, module versions, release, environment, platform,
+    SDK, repositories, and project are computed once.  Every event
+    refers to the same objects instead of copying them, which lets
+    :meth:`~sprockets.mixins.sentry.serializer.Encoder.encode` replace
+    them with a :meth:`fragment` that is serialized only once.
+
+    .. attribute:: fields
+
+       Read-only mapping of event keys to their values.
+
+    """
+
+    def __init__(self, client):
+        self.include_paths = frozenset(client.include_paths)
+        self.fields = types.MappingProxyType({
+            'server_name': client.name,
+            'modules': types.MappingProxyType(client.get_module_versions()),
+            'release': client.release,
+            'environment': client.environment,
+            'platform': base.PLATFORM_NAME,
+            'sdk': base.SDK_VALUE,
+            'repos': client.repos,
+            'project': client.remote.project,
+        })
+        self._fragment = None, None
+
+    def matches(self, client):
+        """Is this skeleton still accurate for `client`?"""
+        fields = self.fields
+        return (fields['server_name'] is client.name
+                and fields['release'] is client.release
+                and fields['environment'] is client.environment
+                and fields['repos'] is client.repos
+                and fields['project'] is client.remote.project
+                and self.include_paths == client.include_paths)
+
+    def apply(self, data):
+        """
+        Layer the shared values under `data`.
+
+        :param dict data: the event data that is being built
+        :returns: `data` with the module versions set unless it already
+            contained them
+
+        raven sets the other fields to the same objects itself.
+
+        """
+        data.setdefault('modules', self.fields['modules'])
+        return data
+
+    def fragment(self, serializer):
+        """
+        Serialize the fields once.
+
+        :param serializer: the serializer that events are serialized with
+        :returns: the members of the serialized JSON object without the
+            enclosing braces
+
+        """
+        cached_serializer, fragment = self._fragment
+        if cached_serializer is not serializer:
+            fields = {key: value for key, value in self.fields.items()
+                      if value is not None}
+            fragment = serializer.dumps(
+                serializer_module.normalize(fields)).strip()[1:-1].strip()
+            self._fragment = serializer, fragment
+        return fragment
+
+    def split(self, data):
+        """
+        Separate the fields that :meth:`fragment` represents.
+
+        :param dict data: a built event
+        :returns: a shallow copy of `data` without the fields that refer
+            to the shared values, and whether any were removed
+
+        Fields that were replaced while the event was built are kept.
+
+        """
+        fields = self.fields
+        if any(data.get(key, fields) is not value
+               for key, value in fields.items() if value is not None):
+            return data, False
+        return {key: value for key, value in data.items()
+                if key not in fields or fields[key] is None}, True
@@ -0,0 +1,129 @@
+"""
+sprockets.mixins.sentry.slow
+
+Report requests that take longer than expected.
+
+"""
+import random
+import re
+
+from sprockets.mixins.sentry import ratelimit
+
+
+class SlowRequestPolicy:
+    """
+    Decide which slow requests are reported.
+
+    :param float threshold: requests that take at least this many
+        seconds are slow
+    :param routes: optional mapping of regular expressions to thresholds.
+        The first expression that matches the request path selects the
+        threshold.  A threshold of :data:`None` disables reporting for
+        the route.
+    :param float sample_rate: fraction of slow requests to report
+    :param float rate: reports per second that are allowed for each
+        handler class once `burst` is exhausted
+    :param int burst: reports that are allowed for each handler class
+        before `rate` applies
+    :param int max_handlers: maximum number of handler classes that are
+        rate limited separately
+
+    The threshold for a request is chosen from the handler's
+    :attr:`~sprockets.mixins.sentry.SentryMixin.sentry_slow_threshold`
+    attribute, a matching `routes` entry, and finally `threshold`.
+
+    .. attribute:: reported
+
+       Number of slow requests that were reported.
+
+    .. attribute:: sampled_out
+
+       Number of slow requests discarded by sampling.
+
+    .. attribute:: rate_limited
+
+       Number of slow requests discarded by rate limiting.
+
+    """
+
+    def __init__(self, threshold=1.0, routes=None, sample_rate=1.0,
+                 rate=1.0 / 60, burst=5, max_handlers=1000):
+        self.threshold = threshold
+        self.routes = [(re.compile(pattern), route_threshold)
+                       for pattern, route_threshold in (routes or {}).items()]
+        self.sample_rate = sample_rate
+        self.reported = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self._limiter = ratelimit.RateLimiter(
+            None, rate=rate, burst=burst, max_fingerprints=max_handlers,
+            summary_interval=None)
+        self._random = random.Random()
+
+    def get_threshold(self, path, handler_threshold=None):
+        """
+        Determine the threshold for a request.
+
+        :param str path: the request path
+        :param float handler_threshold: threshold set on the request
+            handler
+        :returns: the threshold in seconds or :data:`None` if slow
+            requests to `path` are not reported
+
+        """
+        if handler_threshold is not None:
+            return handler_threshold
+        for pattern, route_threshold in self.routes:
+            if pattern.search(path):
+                return route_threshold
+        return self.threshold
+
+    def should_report(self, handler_name):
+        """
+        Should a slow request to `handler_name` be reported?
+
+        :param str handler_name: name of the request handler class
+        :rtype: bool
+
+        """
+        if self.sample_rate < 1.0 and \
+                self._random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        if not self._limiter.admit(handler_name):
+            self.rate_limited += 1
+            return False
+        self.reported += 1
+        return True
+
+
+def breakdown(start_time, prepared, finished, completed, spans):
+    """
+    Describe where the time in a request went.
+
+    :param float start_time: when the request was received
+    :param float prepared: when
+        :meth:`~tornado.web.RequestHandler.prepare` was called
+    :param float finished: when :meth:`~tornado.web.RequestHandler.finish`
+        was called or :data:`None`
+    :param float completed: when the response was finished
+    :param spans: sequence of ``(name, start, end)`` tuples
+    :returns: a :class:`list` of spans with millisecond offsets from
+        `start_time` and durations, ordered by their start
+
+    The ``queue`` span covers the time before the handler was prepared,
+    which includes reading the request body, the ``handler`` span
+    covers :meth:`~tornado.web.RequestHandler.prepare` and the handler
+    method, and the ``finish`` span covers writing the response.
+
+    """
+    entries = [('queue', start_time, prepared)]
+    if finished is not None:
+        entries.append(('handler', prepared, finished))
+        entries.append(('finish', finished, completed))
+    entries.extend(spans)
+    entries.sort(key=lambda entry: entry[1])
+    return [{'name': name,
+             'start_ms': round((start - start_time) * 1000, 3),
+             'duration_ms': round((end - start) * 1000, 3)}
+            for name, start, end in entries]
@@ -0,0 +1,223 @@
+"""
+sprockets.mixins.sentry.snapshot
+
+Copy what an event needs out of a traceback so that it can be released.
+
+An exception's traceback refers to every frame on the stack and every
+frame refers to its local variables, so an event that waits in a queue
+with its ``exc_info`` keeps requests, buffers, and anything else that
+those frames used alive.  :func:`snapshot_exception` converts the
+exception, its chain, and the frame locals into bounded representations
+immediately so that the traceback can be released before the event is
+built.
+
+"""
+import itertools
+import sys
+
+BINARY_TYPES = (bytes, bytearray, memoryview)
+CONTAINER_TYPES = (dict, list, tuple, set, frozenset)
+SCALAR_TYPES = (bool, int, float)
+
+
+class SnapshotLimits:
+    """
+    Bounds for the values that are copied into a snapshot.
+
+    :param int max_length: strings and representations longer than this
+        are truncated
+    :param int max_items: maximum number of items copied from each
+        container and of variables copied from each frame
+    :param int max_depth: containers nested deeper than this are
+        replaced with their truncated representation
+
+    """
+
+    def __init__(self, max_length=256, max_items=25, max_depth=3):
+        self.max_length = max_length
+        self.max_items = max_items
+        self.max_depth = max_depth
+
+    def snapshot(self, value, depth=0):
+        """
+        Copy `value` into a bounded form.
+
+        :param value: the value to copy
+        :param int depth: the nesting depth of `value`
+        :returns: :data:`None`, a number, a truncated :class:`str`, or a
+            :class:`dict` or :class:`list` of bounded values.  Other
+            objects are replaced with their truncated representation.
+
+        """
+        if value is None or isinstance(value, SCALAR_TYPES):
+            return value
+        if isinstance(value, str):
+            return self.truncate(value)
+        if isinstance(value, BINARY_TYPES):
+            return self.truncate(repr(bytes(value[:self.max_length])))
+        if isinstance(value, CONTAINER_TYPES) and depth < self.max_depth:
+            if isinstance(value, dict):
+                return self.snapshot_mapping(value, depth + 1)
+            copied = [self.snapshot(item, depth + 1)
+                      for item in itertools.islice(value, self.max_items)]
+            if len(value) > self.max_items:
+                copied.append(_more(len(value) - self.max_items))
+            return copied
+        try:
+            return self.truncate(repr(value))
+        except Exception:
+            return '<{0} object>'.format(type(value).__name__)
+
+    def snapshot_mapping(self, mapping, depth=0):
+        """Copy the items of `mapping` into a bounded :class:`dict`."""
+        copied = {}
+        for key, value in itertools.islice(mapping.items(), self.max_items):
+            if not isinstance(key, str):
+                key = self.snapshot(key, self.max_depth)
+            copied[self.truncate(key)] = self.snapshot(value, depth)
+        if len(mapping) > self.max_items:
+            copied['...'] = _more(len(mapping) - self.max_items)
+        return copied
+
+    def truncate(self, text):
+        """Shorten `text` to at most ``max_length`` characters."""
+        if self.max_length is not None and len(text) > self.max_length:
+            return text[:self.max_length - 3] + '...'
+        return text
+
+
+class FrameSnapshot:
+    """
+    The parts of a frame that a stack trace is built from.
+
+    This provides the ``f_code``, ``f_globals``, and ``f_locals``
+    attributes that :func:`sprockets.mixins.sentry.frames.get_stack_info`
+    reads.  ``f_globals`` only contains the module's ``__name__`` and
+    ``__loader__`` and ``f_locals`` contains bounded copies or is
+    :data:`None` when locals are not captured.
+
+    """
+
+    __slots__ = ('f_code', 'f_globals', 'f_locals')
+
+    def __init__(self, f_code, f_globals, f_locals):
+        self.f_code = f_code
+        self.f_globals = f_globals
+        self.f_locals = f_locals
+
+
+class ExceptionSnapshot(tuple):
+    """
+    A released exception that can be captured like an ``exc_info``.
+
+    :param exc_type: the exception class
+    :param str message: the exception as a string
+    :param list chain: ``(exc_type, message, frames)`` for the exception
+        and the exceptions that it was raised from, innermost first.
+        `frames` lists ``(FrameSnapshot, lineno)`` from the outermost
+        frame to the innermost.
+
+    This is a ``(exc_type, message, None)`` tuple so that raven's
+    exception filters work.
+    :class:`~sprockets.mixins.sentry.frames.ExceptionEvent` builds the
+    stack traces from :attr:`chain`.
+
+    """
+
+    def __new__(cls, exc_type, message, chain):
+        self = super().__new__(cls, (exc_type, message, None))
+        self.chain = chain
+        return self
+
+
+def snapshot_exception(exc_info, limits, frame_limits=None,
+                       capture_locals=True):
+    """
+    Copy an exception and its frames into an :class:`ExceptionSnapshot`.
+
+    :param exc_info: the ``(type, value, traceback)`` of the exception
+    :param SnapshotLimits limits: bounds for the local variables
+    :param frame_limits: optional
+        :class:`~sprockets.mixins.sentry.frames.FrameLimits` that select
+        the frames and number of variables whose locals are copied
+    :param bool capture_locals: should frame locals be copied?
+    :rtype: ExceptionSnapshot
+
+    The snapshot does not refer to the exception, its traceback, or
+    anything that the frames refer to.  The locals of frames that are
+    still running, such as the caller's, are not copied.
+
+    """
+    chain = []
+    seen = set()
+    exc_type, exc_value, tb = exc_info
+    while exc_value is not None and id(exc_value) not in seen:
+        seen.add(id(exc_value))
+        chain.append((exc_type, str(exc_value),
+                      _snapshot_frames(tb, limits, frame_limits,
+                                       capture_locals)))
+        if exc_value.__suppress_context__:
+            exc_value = exc_value.__cause__
+        else:
+            exc_value = exc_value.__context__
+        if exc_value is not None:
+            exc_type, tb = type(exc_value), exc_value.__traceback__
+    return ExceptionSnapshot(chain[0][0], chain[0][1], chain)
+
+
+def release_log_exc_info(logger, level, msg, args, kwargs):
+    """
+    Drop the ``exc_info`` of a log call before raven records a breadcrumb.
+
+    raven keeps the arguments of the last 100 log calls until their
+    breadcrumbs are built and discards ``exc_info`` then, so every
+    exception logged with its traceback stays alive until the buffer
+    wraps.  This is registered with
+    :func:`raven.breadcrumbs.register_logging_handler` and never
+    suppresses the breadcrumb.
+
+    """
+    kwargs.pop('exc_info', None)
+    return False
+
+
+def _snapshot_frames(tb, limits, frame_limits, capture_locals):
+    frames = []
+    while tb is not None:
+        frame = tb.tb_frame
+        if '__traceback_hide__' not in frame.f_code.co_varnames or \
+                not frame.f_locals.get('__traceback_hide__'):
+            frames.append((frame, tb.tb_lineno))
+        tb = tb.tb_next
+    # Reading f_locals caches the variables on the frame before Python
+    # 3.13.  The frames that are still running, such as the handler's
+    # _execute, usually refer to the exception being handled, and the
+    # cached variables would keep it and the traceback alive in a cycle.
+    running = set()
+    frame = sys._getframe(1)
+    while frame is not None:
+        running.add(frame)
+        frame = frame.f_back
+    first_with_locals = 0
+    if frame_limits is not None and frame_limits.max_depth is not None:
+        first_with_locals = len(frames) - frame_limits.max_depth
+    max_locals = limits.max_items
+    if frame_limits is not None and frame_limits.max_locals is not None:
+        max_locals = min(max_locals, frame_limits.max_locals)
+    snapshots = []
+    for index, (frame, lineno) in enumerate(frames):
+        f_locals = None
+        if capture_locals and index >= first_with_locals and \
+                frame not in running:
+            f_locals = {name: limits.snapshot(value) for name, value in
+                        itertools.islice(frame.f_locals.items(), max_locals)}
+        f_globals = frame.f_globals
+        snapshots.append((FrameSnapshot(
+            frame.f_code, {'__name__': f_globals.get('__name__'),
+                           '__loader__': f_globals.get('__loader__')},
+            f_locals), lineno))
+    return snapshots
+
+
+def _more(count):
+    return '<{0} more>'.format(count)
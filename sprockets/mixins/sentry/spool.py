@@ -0,0 +1,240 @@
+"""
+sprockets.mixins.sentry.spool
+
+Durable, segmented on-disk storage for undelivered events.
+
+"""
+import json
+import logging
+import os
+import re
+import struct
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!dII')  # timestamp, metadata length, data length
+_SEGMENT_RE = re.compile(r'^events-(\d{12})\.spool$')
+_TIMESTAMP_RE = re.compile(r'sentry_timestamp=[\d.]+')
+
+
+class Spool:
+    """
+    Append-only event storage split into segment files.
+
+    :param str path: directory to store segments in.  It is created if
+        it does not exist.
+    :param int segment_bytes: start a new segment once the current one
+        reaches this size.
+    :param int max_bytes: discard the oldest segments once the spool
+        exceeds this size.
+    :param float max_age: discard segments that have not been written
+        to for this many seconds, and records older than this.
+
+    Records are appended to the newest segment and read from the oldest.
+    Reading is a two step process: :meth:`peek` returns the next record
+    and :meth:`advance` consumes it once it has been delivered.  Fully
+    consumed segments are deleted.  The read position is not persisted,
+    so events may be delivered more than once after a restart; Sentry
+    discards the duplicates since they share an event ID.
+
+    .. attribute:: discarded
+
+       Number of records lost to the size and age limits.
+
+    """
+
+    def __init__(self, path, segment_bytes=1024 * 1024,
+                 max_bytes=64 * 1024 * 1024, max_age=24 * 60 * 60):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.discarded = 0
+        os.makedirs(path, exist_ok=True)
+        self._segments = sorted(
+            int(match.group(1)) for match in
+            (_SEGMENT_RE.match(name) for name in os.listdir(path))
+            if match)
+        # maintained by append so that the limits never read the disk
+        self._sizes, self._mtimes, self._counts = {}, {}, {}
+        for segment in self._segments:
+            try:
+                stat = os.stat(self._segment_path(segment))
+                self._counts[segment] = self._count_records(segment)
+            except OSError:
+                self._sizes[segment], self._mtimes[segment] = 0, time.time()
+                self._counts[segment] = 0
+            else:
+                self._sizes[segment] = stat.st_size
+                self._mtimes[segment] = stat.st_mtime
+        self._size = sum(self._sizes.values())
+        self._writer = None
+        self._reader = None
+        self._read_offset = 0
+        self._read_count = 0
+        self._pending = None
+
+    def __bool__(self):
+        return self.peek() is not None
+
+    @property
+    def size(self):
+        """Number of bytes that the segments occupy on disk."""
+        return self._size
+
+    def append(self, url, headers, data):
+        """
+        Write an encoded event to the spool.
+
+        :param str url: the URL that the event is sent to
+        :param dict headers: the HTTP headers for the request
+        :param bytes data: the encoded event
+
+        """
+        metadata = json.dumps({'url': url, 'headers': headers}).encode()
+        record = _HEADER.pack(time.time(), len(metadata), len(data))
+        length = len(record) + len(metadata) + len(data)
+        writer = self._get_writer(length)
+        writer.write(record + metadata + data)
+        segment = self._segments[-1]
+        self._sizes[segment] += length
+        self._mtimes[segment] = time.time()
+        self._counts[segment] += 1
+        self._size += length
+        self._enforce_limits()
+
+    def peek(self):
+        """
+        Return the oldest record without consuming it.
+
+        :returns: a tuple of ``(url, headers, data)`` or :data:`None` if
+            the spool is empty.
+
+        """
+        while self._pending is None:
+            if not self._segments:
+                return None
+            record = self._read_record()
+            if record is None:
+                if self._segments[0] == self._current_segment:
+                    return None
+                self._remove_segment(self._segments[0])
+                continue
+            timestamp, url, headers, data = record
+            if self.max_age is not None and \
+                    time.time() - timestamp > self.max_age:
+                self.discarded += 1
+                self._pending = None
+                continue
+            headers = dict(headers)
+            if 'X-Sentry-Auth' in headers:
+                headers['X-Sentry-Auth'] = _TIMESTAMP_RE.sub(
+                    'sentry_timestamp={0}'.format(time.time()),
+                    headers['X-Sentry-Auth'])
+            self._pending = url, headers, data
+        return self._pending
+
+    def advance(self):
+        """Consume the record returned by :meth:`peek`."""
+        self._pending = None
+
+    def close(self):
+        """Close the open segment files."""
+        for handle in (self._writer, self._reader):
+            if handle is not None:
+                handle.close()
+        self._writer = self._reader = None
+
+    @property
+    def _current_segment(self):
+        return self._segments[-1] if self._writer is not None else None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, 'events-{0:012d}.spool'.format(segment))
+
+    def _get_writer(self, length):
+        if self._writer is not None and \
+                self._writer.tell() + length > self.segment_bytes:
+            self._writer.close()
+            self._writer = None
+        if self._writer is None:
+            segment = self._segments[-1] + 1 if self._segments else 1
+            self._segments.append(segment)
+            self._sizes[segment], self._mtimes[segment] = 0, time.time()
+            self._counts[segment] = 0
+            self._writer = open(self._segment_path(segment), 'ab',
+                                buffering=0)
+        return self._writer
+
+    def _read_record(self):
+        """Read the next record, tracking the offset of the last read."""
+        if self._reader is None:
+            self._reader = open(self._segment_path(self._segments[0]), 'rb')
+            self._read_offset = 0
+            self._read_count = 0
+        self._reader.seek(self._read_offset)
+        header = self._reader.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None
+        timestamp, metadata_length, data_length = _HEADER.unpack(header)
+        metadata = self._reader.read(metadata_length)
+        data = self._reader.read(data_length)
+        if len(metadata) < metadata_length or len(data) < data_length:
+            return None  # partially written record
+        self._read_offset = self._reader.tell()
+        self._read_count += 1
+        metadata = json.loads(metadata.decode())
+        return timestamp, metadata['url'], metadata['headers'], data
+
+    def _remove_segment(self, segment, discarded=False):
+        count = self._counts.pop(segment)
+        if segment == self._segments[0] and self._reader is not None:
+            # the pending record was read but has not been delivered
+            count -= self._read_count - (self._pending is not None)
+            self._reader.close()
+            self._reader = None
+            self._pending = None
+        if discarded:
+            self.discarded += max(count, 0)
+        if segment == self._current_segment:
+            self._writer.close()
+            self._writer = None
+        self._segments.remove(segment)
+        self._size -= self._sizes.pop(segment)
+        del self._mtimes[segment]
+        try:
+            os.unlink(self._segment_path(segment))
+        except OSError as error:
+            LOGGER.warning('failed to remove spool segment: %s', error)
+
+    def _count_records(self, segment):
+        count = 0
+        with open(self._segment_path(segment), 'rb') as handle:
+            while True:
+                header = handle.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return count
+                _, metadata_length, data_length = _HEADER.unpack(header)
+                handle.seek(metadata_length + data_length, os.SEEK_CUR)
+                count += 1
+
+    def _enforce_limits(self):
+        """
+        Discard the oldest segments once the limits are exceeded.
+
+        The sizes, ages, and record counts are kept in memory, so the
+        only file system access is unlinking the discarded segments.
+
+        """
+        now = time.time()
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            expired = (self.max_age is not None and
+                       now - self._mtimes[oldest] > self.max_age)
+            if not expired and (self.max_bytes is None or
+                                self._size <= self.max_bytes):
+                break
+            LOGGER.warning('discarding spooled sentry events in %s',
+                           self._segment_path(oldest))
+            self._remove_segment(oldest, discarded=True)
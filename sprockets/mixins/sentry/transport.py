@@ -0,0 +1,312 @@
+"""
+sprockets.mixins.sentry.transport
+
+IOLoop-native delivery of Sentry events.
+
+"""
+import collections
+import logging
+
+from raven.exceptions import APIError, RateLimited
+from raven.transport.base import AsyncTransport
+from raven.transport.http import HTTPTransport
+from tornado import gen, httpclient, ioloop, locks
+
+from sprockets.mixins.sentry import metrics, serializer
+
+try:
+    from tornado import curl_httpclient
+except ImportError:  # pragma: no cover -- pycurl is optional
+    curl_httpclient = None
+
+LOGGER = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop-oldest'
+"""Discard the oldest queued event when the queue is full."""
+
+DROP_NEWEST = 'drop-newest'
+"""Discard the event being queued when the queue is full."""
+
+
+class EventQueue:
+    """
+    Bounded FIFO of pending sends with a configurable overflow policy.
+
+    :param int max_size: maximum number of entries to retain.
+    :param str overflow: :data:`DROP_OLDEST` or :data:`DROP_NEWEST`.
+
+    .. attribute:: dropped
+
+       Number of entries that were discarded because the queue was full.
+
+    """
+
+    def __init__(self, max_size=1000, overflow=DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('unknown overflow policy {0!r}'.format(overflow))
+        self.max_size = max_size
+        self.overflow = overflow
+        self.dropped = 0
+        self._entries = collections.deque()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, entry):
+        """
+        Append `entry` to the queue.
+
+        :returns: the entry that was discarded to make room or :data:`None`
+
+        """
+        if len(self._entries) < self.max_size:
+            self._entries.append(entry)
+            return None
+        self.dropped += 1
+        if self.overflow == DROP_NEWEST:
+            return entry
+        discarded = self._entries.popleft()
+        self._entries.append(entry)
+        return discarded
+
+    def take(self, count):
+        """Remove and return up to `count` entries from the head."""
+        batch = []
+        while self._entries and len(batch) < count:
+            batch.append(self._entries.popleft())
+        return batch
+
+
+class TornadoTransport(AsyncTransport, HTTPTransport):
+    """
+    Queue events in memory and deliver them in batches from the IOLoop.
+
+    :param int max_queue_size: number of events to hold before the
+        overflow policy kicks in.
+    :param str overflow: :data:`DROP_OLDEST` or :data:`DROP_NEWEST`.
+    :param int batch_size: maximum number of requests that are in
+        flight at the same time.
+    :param http_client: optional :class:`tornado.httpclient.AsyncHTTPClient`
+        to deliver with.  The default is the shared ``curl`` client for
+        the current IOLoop when :mod:`pycurl` is installed since it keeps
+        connections alive, otherwise the shared default client.
+    :param spool: optional :class:`~sprockets.mixins.sentry.spool.Spool`
+        that holds events while Sentry is unreachable.
+    :param float replay_rate: maximum number of spooled events to send
+        per second once Sentry is reachable again.
+    :param float replay_interval: seconds between attempts to replay
+        the spool while Sentry is unreachable.
+
+    Remaining parameters are passed to
+    :class:`raven.transport.http.HTTPTransport`.
+
+    Events are only appended to a bounded queue when they are captured.
+    A callback scheduled on the IOLoop drains the queue, so the request
+    that raised never waits on Sentry.  If the client hands the transport
+    an unencoded event (see :class:`sprockets.mixins.sentry.Client`),
+    encoding is deferred until the event is drained as well.
+
+    When a `spool` is configured, events that fail to deliver because of
+    a connection error, a timeout, rate limiting, or a server error are
+    written to it instead of being dropped.  Until the spool has been
+    replayed, newly captured events are written straight to the spool
+    so memory use stays flat for the duration of the outage.  Spooling
+    happens on the IOLoop: an event that is not encoded yet is encoded
+    and every event is appended to the segment file with a blocking
+    write.  Enable the worker pool to encode events on worker threads so
+    that only the write remains.
+
+    """
+
+    scheme = ['sprockets+http', 'sprockets+https']
+
+    def __init__(self, *args, max_queue_size=1000, overflow=DROP_OLDEST,
+                 batch_size=10, http_client=None, spool=None,
+                 replay_rate=10.0, replay_interval=5.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+        self.encoder = None
+        self.metrics = None
+        self.queue = EventQueue(max_queue_size, overflow)
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.replay_interval = replay_interval
+        self._http_client = http_client
+        self._flushing = False
+        self._outage = spool is not None and bool(spool)
+        self._replay_scheduled = False
+        self._idle = locks.Event()
+        self._idle.set()
+
+    @property
+    def dropped(self):
+        """Number of events discarded due to queue overflow."""
+        return self.queue.dropped
+
+    @property
+    def http_client(self):
+        if self._http_client is not None:
+            return self._http_client
+        if curl_httpclient is not None:
+            return curl_httpclient.CurlAsyncHTTPClient()
+        return httpclient.AsyncHTTPClient()
+
+    def start(self):
+        """
+        Replay the events that a previous process left in the spool.
+
+        Otherwise they would wait until the next event fails to deliver.
+
+        """
+        if self._outage and not self._replay_scheduled:
+            self._replay_scheduled = True
+            ioloop.IOLoop.current().add_callback(self._replay)
+
+    def async_send(self, url, data, headers, success_cb, failure_cb,
+                   started_cb=None):
+        """
+        Queue an event for delivery.
+
+        :param started_cb: optional callable that is invoked when the
+            event is posted to Sentry, after it has waited in the queue
+
+        The remaining parameters are those of
+        :meth:`raven.transport.base.AsyncTransport.async_send`.
+
+        """
+        if self._outage:
+            self._spool(url, headers, data)
+            return
+        discarded = self.queue.put(
+            (url, data, headers, success_cb, failure_cb, started_cb))
+        if discarded is not None:
+            LOGGER.debug('sentry queue is full, dropping event')
+        if self.metrics is not None:
+            if discarded is not None:
+                self.metrics.increment(metrics.DROPPED)
+            self.metrics.gauge(metrics.QUEUE_DEPTH, len(self.queue))
+        if not self._flushing:
+            self._flushing = True
+            self._idle.clear()
+            ioloop.IOLoop.current().add_callback(self._drain)
+
+    async def flush(self, timeout=None):
+        """
+        Wait for every queued event to be delivered.
+
+        :param float timeout: optional number of seconds to wait.
+        :raises tornado.util.TimeoutError: if `timeout` elapses first.
+
+        Call this when shutting down so that events captured just
+        before the IOLoop stops are not lost.
+
+        """
+        if timeout is None:
+            await self._idle.wait()
+        else:
+            await self._idle.wait(ioloop.IOLoop.current().time() + timeout)
+
+    async def _drain(self):
+        try:
+            batch = self.queue.take(self.batch_size)
+            while batch:
+                if self.metrics is not None:
+                    self.metrics.gauge(metrics.QUEUE_DEPTH, len(self.queue))
+                await gen.multi([self._deliver(*entry) for entry in batch])
+                batch = self.queue.take(self.batch_size)
+        finally:
+            self._flushing = False
+            self._idle.set()
+
+    async def _deliver(self, url, data, headers, success_cb, failure_cb,
+                       started_cb):
+        try:
+            data, headers = self._encode(data, headers)
+            if started_cb is not None:
+                started_cb()
+            await self._post(url, data, headers)
+        except Exception as error:
+            if self.spool is not None and self._is_retriable(error):
+                self._spool(url, headers, data)
+            elif isinstance(error, httpclient.HTTPError):
+                failure_cb(self._translate_error(error))
+            else:
+                failure_cb(error)
+        else:
+            success_cb()
+
+    def _post(self, url, data, headers):
+        return self.http_client.fetch(
+            url, method='POST', headers=headers, body=data,
+            connect_timeout=self.timeout, request_timeout=self.timeout,
+            validate_cert=self.verify_ssl, ca_certs=self.ca_certs)
+
+    def _encode(self, data, headers):
+        if isinstance(data, bytes):
+            return data, headers
+        data = self.encoder(data)
+        if not serializer.is_compressed(data):
+            headers = dict(headers)
+            headers.pop('Content-Encoding', None)
+        return data, headers
+
+    def _spool(self, url, headers, data):
+        data, headers = self._encode(data, headers)
+        try:
+            self.spool.append(url, headers, data)
+        except OSError as error:
+            LOGGER.error('failed to spool sentry event: %s', error)
+        self._outage = True
+        if not self._replay_scheduled:
+            self._replay_scheduled = True
+            ioloop.IOLoop.current().call_later(self.replay_interval,
+                                               self._replay)
+
+    async def _replay(self):
+        # _replay_scheduled stays set until the spool is empty so that
+        # events spooled meanwhile do not start a concurrent replay that
+        # posts the same record
+        rescheduled = False
+        try:
+            while True:
+                record = self.spool.peek()
+                if record is None:
+                    self._outage = False
+                    return
+                url, headers, data = record
+                try:
+                    await self._post(url, data, headers)
+                except Exception as error:
+                    if self._is_retriable(error):
+                        LOGGER.debug('sentry is still unreachable: %s', error)
+                        rescheduled = True
+                        ioloop.IOLoop.current().call_later(
+                            self.replay_interval, self._replay)
+                        return
+                    LOGGER.warning('dropping spooled sentry event: %s', error)
+                self.spool.advance()
+                await gen.sleep(1.0 / self.replay_rate)
+        finally:
+            if not rescheduled:
+                self._replay_scheduled = False
+
+    @staticmethod
+    def _is_retriable(error):
+        if isinstance(error, httpclient.HTTPError):
+            return error.code == 429 or error.code >= 500
+        return isinstance(error, OSError)
+
+    @staticmethod
+    def _translate_error(error):
+        if error.response is None:
+            return error
+        message = error.response.headers.get('X-Sentry-Error')
+        if error.code == 429:
+            try:
+                retry_after = int(error.response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = 0
+            return RateLimited(message, retry_after)
+        if message:
+            return APIError(message, error.code)
+        return error
@@ -0,0 +1,196 @@
+"""
+sprockets.mixins.sentry.watchdog
+
+Report code that blocks the IOLoop.
+
+"""
+import collections
+import linecache
+import logging
+import random
+import sys
+import threading
+import time
+
+from tornado import ioloop
+
+from sprockets.mixins.sentry import ratelimit
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_FRAMES = 100
+"""Maximum number of frames that are captured for a stall."""
+
+
+class StallDetector:
+    """
+    Detect callbacks that block the IOLoop for too long.
+
+    :param client: the :class:`raven.base.Client` to report stalls with
+    :param float threshold: seconds without a heartbeat that constitute
+        a stall
+    :param float interval: seconds between heartbeats and checks.  This
+        defaults to a quarter of `threshold`.
+    :param float sample_rate: fraction of stalls to report
+    :param float dedupe_interval: seconds during which further stalls in
+        the same place are counted instead of reported
+    :param int max_fingerprints: maximum number of stall locations that
+        are remembered for deduplication
+
+    A periodic callback on the IOLoop records a heartbeat and a daemon
+    thread checks it at the same interval.  When the heartbeat is older
+    than `threshold`, the thread captures the stack of the IOLoop's
+    thread with :func:`sys._current_frames`, which shows the code that
+    is blocking it.  The event is sent from the IOLoop once it is
+    running again, so that the stall duration is known and the client's
+    transport is used from the right thread.
+
+    Stalls are deduplicated by the innermost application frame of the
+    captured stack.
+
+    .. attribute:: stalls
+
+       Number of stalls that were detected.
+
+    .. attribute:: reported
+
+       Number of stalls that were reported.
+
+    .. attribute:: suppressed
+
+       Number of stalls that were not reported because of
+       deduplication or sampling.
+
+    """
+
+    def __init__(self, client, threshold=0.5, interval=None,
+                 sample_rate=1.0, dedupe_interval=300.0,
+                 max_fingerprints=1000):
+        self.client = client
+        self.threshold = threshold
+        self.interval = interval or threshold / 4.0
+        self.sample_rate = sample_rate
+        self.dedupe_interval = dedupe_interval
+        self.max_fingerprints = max_fingerprints
+        self.stalls = 0
+        self.reported = 0
+        self.suppressed = 0
+        self._last_beat = None
+        self._loop_thread = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._heartbeat = None
+        self._fingerprints = collections.OrderedDict()
+        self._random = random.Random()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Start monitoring the current IOLoop."""
+        if self.running:
+            return
+        self._stopped.clear()
+        self._heartbeat = ioloop.PeriodicCallback(self._beat,
+                                                  self.interval * 1000)
+        self._heartbeat.start()
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='sentry-stall-detector',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop monitoring."""
+        if not self.running:
+            return
+        self._heartbeat.stop()
+        self._stopped.set()
+        self._thread.join()
+        self._thread = self._heartbeat = None
+        self._last_beat = None
+
+    def _beat(self):
+        now = time.monotonic()
+        if self._loop_thread is None:
+            self._loop_thread = threading.get_ident()
+        with self._lock:
+            stall, self._pending = self._pending, None
+            gap = now - (self._last_beat or now)
+            self._last_beat = now
+        if stall is not None:
+            self._report(stall, gap)
+
+    def _monitor(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                if self._last_beat is None or self._pending is not None:
+                    continue
+                if time.monotonic() - self._last_beat < self.threshold:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is None:
+                    continue
+                self._pending = _extract(frame)
+                self.stalls += 1
+            LOGGER.warning('IOLoop has been blocked for more than %.3f '
+                           'seconds', self.threshold)
+
+    def _report(self, stack, duration):
+        key = _fingerprint(stack, self.client.include_paths,
+                           self.client.exclude_paths)
+        now = time.monotonic()
+        last = self._fingerprints.get(key)
+        if last is not None and now - last < self.dedupe_interval:
+            self.suppressed += 1
+            return
+        if self.sample_rate < 1.0 and \
+                self._random.random() >= self.sample_rate:
+            self.suppressed += 1
+            return
+        self._fingerprints[key] = now
+        self._fingerprints.move_to_end(key)
+        if len(self._fingerprints) > self.max_fingerprints:
+            self._fingerprints.popitem(last=False)
+        self.reported += 1
+        self.client.captureMessage(
+            'IOLoop blocked for {0:.3f} seconds'.format(duration),
+            level=logging.WARNING,
+            extra={'stall_seconds': round(duration, 6),
+                   'threshold_seconds': self.threshold},
+            data={'logger': 'sprockets.mixins.sentry',
+                  'fingerprint': ['ioloop-stall', '{0}:{1}:{2}'.format(*key)],
+                  'stacktrace': {'frames': [
+                      _format_frame(frame, self.client.include_paths,
+                                    self.client.exclude_paths)
+                      for frame in stack]}})
+
+
+def _extract(frame):
+    """Capture ``(module, filename, function, lineno)`` outermost first."""
+    stack = []
+    while frame is not None and len(stack) < MAX_FRAMES:
+        stack.append((frame.f_globals.get('__name__', '?'),
+                      frame.f_code.co_filename, frame.f_code.co_name,
+                      frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _fingerprint(stack, include_paths, exclude_paths):
+    for module, _, function, lineno in reversed(stack):
+        if ratelimit.in_app(module, include_paths, exclude_paths):
+            return module, function, lineno
+    module, _, function, lineno = stack[-1]
+    return module, function, lineno
+
+
+def _format_frame(frame, include_paths, exclude_paths):
+    module, filename, function, lineno = frame
+    return {'module': module, 'filename': filename, 'abs_path': filename,
+            'function': function, 'lineno': lineno,
+            'context_line': linecache.getline(filename, lineno).rstrip(),
+            'in_app': ratelimit.in_app(module, include_paths, exclude_paths)}
@@ -0,0 +1,180 @@
+"""
+sprockets.mixins.sentry.workers
+
+Build events on worker threads instead of on the IOLoop.
+
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import threading
+
+from tornado import gen, ioloop
+
+from sprockets.mixins.sentry import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    Build, sanitize, and encode events in a bounded thread pool.
+
+    :param client: the :class:`~sprockets.mixins.sentry.client.Client`
+        that events are captured with
+    :param int max_workers: number of worker threads
+    :param int max_pending: maximum number of events that are waiting
+        for or being built by a worker.  Further events are dropped
+        until the backlog shrinks.
+
+    :class:`~sprockets.mixins.sentry.SentryMixin` takes a snapshot of
+    a failing or slow request on the IOLoop and submits it here.  The
+    worker captures the exception or message with the client, which
+    walks the frames, runs the processors, and encodes the event, and
+    the encoded event is handed back to the IOLoop to be sent.  Raven's
+    thread-local context is not available to the worker, so tags and
+    extra values must be set on the handler or the client.
+
+    The threads are started by the first event.
+
+    .. attribute:: submitted
+
+       Number of events that were accepted.
+
+    .. attribute:: dropped
+
+       Number of events that were discarded because `max_pending` events
+       were already waiting.
+
+    .. attribute:: failed
+
+       Number of events that could not be built.
+
+    """
+
+    def __init__(self, client, max_workers=1, max_pending=100):
+        self.client = client
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self._executor = None
+        self._futures = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def pending(self):
+        """Number of events that are waiting for or being built."""
+        return len(self._futures)
+
+    def submit(self, exc_info, build_kwargs):
+        """
+        Capture an exception on a worker thread.
+
+        :param exc_info: the ``(type, value, traceback)`` of the exception
+        :param build_kwargs: zero argument callable that returns the
+            keyword parameters for
+            :meth:`raven.base.Client.captureException`.  It is called on
+            the worker thread.
+        :returns: :data:`False` if the event was dropped
+        :rtype: bool
+
+        This must be called from the IOLoop that the event is sent from.
+
+        """
+        return self._submit(functools.partial(self.client.captureException,
+                                              exc_info=exc_info),
+                            build_kwargs)
+
+    def submit_message(self, message, build_kwargs):
+        """
+        Capture a message on a worker thread.
+
+        :param str message: the message to capture
+        :param build_kwargs: zero argument callable that returns the
+            keyword parameters for :meth:`raven.base.Client.captureMessage`.
+            It is called on the worker thread.
+        :returns: :data:`False` if the event was dropped
+        :rtype: bool
+
+        This must be called from the IOLoop that the event is sent from.
+
+        """
+        return self._submit(functools.partial(self.client.captureMessage,
+                                              message),
+                            build_kwargs)
+
+    def _submit(self, capture, build_kwargs):
+        recorder = self.client.metrics
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                self.dropped += 1
+                if recorder is not None:
+                    recorder.increment(metrics.WORKER_DROPPED)
+                return False
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='sentry-worker')
+            future = self._executor.submit(
+                self._capture, ioloop.IOLoop.current(), capture,
+                build_kwargs)
+            self._futures.add(future)
+            self.submitted += 1
+            depth = len(self._futures)
+        future.add_done_callback(self._discard)
+        if recorder is not None:
+            recorder.gauge(metrics.WORKER_PENDING, depth)
+        return True
+
+    def current_loop(self):
+        """
+        Return the IOLoop that the current worker's event is sent from.
+
+        :returns: the :class:`~tornado.ioloop.IOLoop` or :data:`None`
+            when this is not called from a worker
+
+        """
+        return getattr(self._local, 'loop', None)
+
+    async def join(self, timeout=None):
+        """
+        Wait for the events that were submitted to be handed back.
+
+        :param float timeout: optional number of seconds to wait.
+
+        """
+        with self._lock:
+            futures = [asyncio.wrap_future(future)
+                       for future in self._futures]
+        if not futures:
+            return
+        waiter = gen.multi(futures)
+        if timeout is not None:
+            waiter = gen.with_timeout(ioloop.IOLoop.current().time() +
+                                      timeout, waiter)
+        await waiter
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _capture(self, loop, capture, build_kwargs):
+        self._local.loop = loop
+        try:
+            capture(**build_kwargs())
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            LOGGER.exception('failed to build sentry event')
+        finally:
+            self._local.loop = None
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)